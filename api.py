@@ -1,12 +1,15 @@
+import asyncio
 import json
 import shlex
 
 from fastapi import APIRouter
-from fastapi import BackgroundTasks
 from fastapi import Request
 from fastapi import Response
 
 from commands import handle_request
+from core import AI_HANDLERS
+from core import JobQueue
+from core import RESPONSE_CACHE
 from defines import *
 
 router = APIRouter()
@@ -14,13 +17,58 @@ router = APIRouter()
 LEGAL_ACTIONS = {x.value for x in list(CommandType)}
 
 
+async def _run_job(payload):
+    """
+    执行队列中的命令任务
+
+    Args:
+        payload (dict): 入队时的参数
+
+    Returns:
+        None
+    """
+    command = CommandType(payload["command"])
+    await handle_request(payload["git_base"], payload["token"], payload["url"], command, payload["args"])
+
+
+# 访问密钥只在任务需要执行时保留在队列中
+JOB_QUEUE = JobQueue(
+    CONFIG.queue.path,
+    CONFIG.queue.workers,
+    CONFIG.queue.max_attempts,
+    _run_job,
+    secret_keys=("token",),
+    retry_delay=CONFIG.queue.retry_delay,
+)
+
+
+def _enqueue(git_base, token, url, command, args, head_sha):
+    """
+    将命令加入持久化队列（按MR所属项目公平调度，MR出现新的head时基于旧head执行中的任务会被取消）
+
+    Args:
+        git_base (str): gitlab的地址
+        token (str): 项目的访问密钥
+        url (str): merge request的URL
+        command (CommandType): 执行的命令
+        args (list | None): 附加参数
+        head_sha (str | None): webhook中MR最新提交的sha
+
+    Returns:
+        int: 任务ID
+    """
+    project = url.split("/merge_requests")[0].removesuffix("/-")
+    payload = {"git_base": git_base, "token": token, "url": url, "command": command.value, "args": args}
+    kind = json.dumps([command.value, args or []])
+    return JOB_QUEUE.enqueue(project, payload, mr=url, kind=kind, head_sha=head_sha)
+
+
 @router.post("/webhook")
-async def gitlab_webhook(background_tasks: BackgroundTasks, request: Request):
+async def gitlab_webhook(request: Request):
     """
     Webhook监听接口（命令解析入口）
 
     Args:
-        background_tasks (BackgroundTasks): 后台任务
         request (Request): 请求参数
 
     Returns:
@@ -42,11 +90,18 @@ async def gitlab_webhook(background_tasks: BackgroundTasks, request: Request):
         # 新建或者重新开启一个MR的时候
         title = data["object_attributes"].get("title")
         url = data["object_attributes"].get("url")
+        head_sha = (data["object_attributes"].get("last_commit") or {}).get("id")
         if "mr:skip" in data["object_attributes"].get("description", ""):
-            background_tasks.add_task(handle_request, git_base, token, url, CommandType.Help, None)
+            _enqueue(git_base, token, url, CommandType.Help, None, None)
         else:
-            background_tasks.add_task(handle_request, git_base, token, url, CommandType.Review, None)
+            _enqueue(git_base, token, url, CommandType.Review, None, head_sha)
         return {"message": f"{CommandType.Help.value}: {title}"}
+    elif data.get("object_kind") == "merge_request" and data["object_attributes"].get("oldrev"):
+        # MR有新的推送，基于旧版本执行中的任务会被取消并基于新版本重新执行
+        url = data["object_attributes"].get("url")
+        head_sha = (data["object_attributes"].get("last_commit") or {}).get("id")
+        superseded = JOB_QUEUE.supersede(url, head_sha) if head_sha else 0
+        return {"message": f"superseded: {superseded}"}
     elif data.get("object_kind") == "note" and data["event_type"] == "note":
         # 找到mr的url信息
         if "merge_request" in data:
@@ -64,9 +119,43 @@ async def gitlab_webhook(background_tasks: BackgroundTasks, request: Request):
             command, *args = list(lexer)
             if command in LEGAL_ACTIONS:
                 command = CommandType(command)
-                background_tasks.add_task(handle_request, git_base, token, url, command, args)
+                head_sha = (data.get("merge_request", {}).get("last_commit") or {}).get("id")
+                _enqueue(git_base, token, url, command, args, None if command == CommandType.Help else head_sha)
                 return Response(json.dumps({"message": f"{command.value}: Accepted"}), status_code=202)
             else:
                 return Response(status_code=422)
     else:
         return Response(status_code=404)
+
+
+@router.get("/cache/stats")
+async def cache_stats():
+    """
+    AI响应缓存的命中统计
+
+    Returns:
+        dict
+    """
+    return await asyncio.to_thread(RESPONSE_CACHE.stats) if RESPONSE_CACHE else {"enable": False}
+
+
+@router.get("/queue/stats")
+async def queue_stats():
+    """
+    任务队列中各状态的任务数量
+
+    Returns:
+        dict
+    """
+    return JOB_QUEUE.stats()
+
+
+@router.get("/ai/stats")
+async def ai_stats():
+    """
+    各模型推理服务地址的负载以及熔断状态
+
+    Returns:
+        list[dict]
+    """
+    return [handler.stats() for handler in AI_HANDLERS]
@@ -1,3 +1,7 @@
+import asyncio
+import json
+
+from ._commands_base import RUNNING_COMMENT
 from .describe import CommandDescribe
 from .describe import CommandDescribeParams
 from .help import COMMAND_MAP
@@ -8,6 +12,9 @@ from .review import CommandReviewParams
 from core import *
 from utils import *
 
+# 合并同一个MR版本上参数相同、同时执行的命令（重复的webhook或者重复的评论）
+_IN_FLIGHT = SingleFlight()
+
 
 def _parse_args(args):
     """
@@ -33,6 +40,50 @@ def _parse_args(args):
     return args_dict
 
 
+def _normalize_args(params, args_dict):
+    """
+    将命令参数规范化为字符串（别名与全名、显式传递默认值等写法视为相同的参数）
+
+    Args:
+        params (CommandParams): 反序列化后的参数
+        args_dict (dict): 原始参数
+
+    Returns:
+        str
+    """
+    fields = set(params.model_fields) | {v.alias for v in params.model_fields.values() if v.alias}
+    extra = sorted(k for k in args_dict if k not in fields)
+    return json.dumps([params.model_dump(), extra], sort_keys=True, default=str)
+
+
+async def _execute(git_provider, command_cls, params, args_dict):
+    """
+    实例化命令并执行
+
+    Args:
+        git_provider (GitProvider):
+        command_cls (type[CommandBase]):
+        params (CommandParams):
+        args_dict (dict):
+
+    Returns:
+        None
+
+    Raises:
+        Exception: 命令执行失败（交由任务队列决定是否重新执行）
+    """
+    # GitLab请求是同步的，都放到线程中执行，避免阻塞事件循环
+    try:
+        await asyncio.to_thread(git_provider.publish_comment, RUNNING_COMMENT, is_temporary=True)
+        item = await asyncio.to_thread(command_cls, git_provider, params, original_params=args_dict)
+        await item.run()
+    except Exception as ex:
+        logger.exception(ex)
+        raise
+    finally:
+        await asyncio.to_thread(git_provider.remove_initial_comment)
+
+
 async def handle_request(git_base, token, mr_url, command, args):
     """
     处理Webhook请求，根据不同的命令类型调用具体的实现
@@ -53,13 +104,16 @@ async def handle_request(git_base, token, mr_url, command, args):
     command_cls, params_cls = COMMAND_MAP[command]
     # Step 3. 实例化GitProvider以及附加参数
     params = params_cls.deserialize(args_dict)
-    git_provider = GitProvider(git_base, token, mr_url)
-    item = command_cls(git_provider, params, original_params=args_dict)
-    # Step 4. 统一执行命令的调用
-    try:
-        git_provider.publish_comment("命令执行中，请稍后...", is_temporary=True)
-        await item.run()
-    except Exception as ex:
-        logger.exception(ex)
-    finally:
-        git_provider.remove_initial_comment()
+    git_provider = await asyncio.to_thread(create_git_provider, git_base, token, mr_url)
+    # 标记任务实际基于的版本，MR出现更新的版本时该任务会被取消
+    tag_current_job(git_provider.mr.diff_refs["head_sha"])
+    # Step 4. 统一执行命令的调用（同一个MR版本上相同的命令正在执行时直接共享其结果）
+    key = (
+        git_base,
+        git_provider.project_id,
+        git_provider.mr.iid,
+        command.value,
+        _normalize_args(params, args_dict),
+        git_provider.mr.diff_refs["head_sha"],
+    )
+    await _IN_FLIGHT.do(key, lambda: _execute(git_provider, command_cls, params, args_dict))
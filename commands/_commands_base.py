@@ -1,7 +1,6 @@
 import asyncio
+import contextlib
 import copy
-import os.path
-import pickle
 
 from jinja2 import Environment
 from jinja2 import StrictUndefined
@@ -12,6 +11,8 @@ from utils import *
 
 # 各种模板种的待替换内容的常量字典
 CONSTANTS_DICT = {k: v for k, v in CONSTANTS.__dict__.items() if k.isupper()}
+# 命令执行期间的临时评论内容
+RUNNING_COMMENT = "命令执行中，请稍后..."
 
 
 class CommandBase:
@@ -53,17 +54,54 @@ class CommandBase:
 
         Returns:
             None
+
+        Raises:
+            Exception: 所有模型都没有成功发布结果时抛出，由任务队列重新执行
         """
-        try:
-            await self.generate_prediction()
-            for model, prediction in self.prediction.items():
-                if data := load_yaml(prediction):
-                    self.subclass_run(model, data)
-                elif prediction:
-                    # 不是预期的结构但是有响应数据也直接添加评论，不能浪费
-                    self.git_provider.publish_comment(f"{model}:{prediction}")
-        except Exception as e:
-            logger.exception(f"Failed: {e=}")
+        # 获取差异等GitLab请求是同步的（可能因重试而等待），不能阻塞事件循环
+        prompts = await asyncio.to_thread(self._build_prompts)
+        # 所有模型并发调用，每个模型完成后立即发布结果，慢的模型不会拖慢快的模型
+        predictions = [self.generate_prediction(handler, prompts) for handler in AI_HANDLERS]
+        failures = []
+        published = 0
+        for future in asyncio.as_completed(predictions):
+            model, prediction, error = await future
+            if error is None and prediction:
+                try:
+                    await asyncio.to_thread(self._publish, model, prediction)
+                    self.prediction[model] = prediction
+                    published += 1
+                    continue
+                except Exception as ex:
+                    logger.exception(f"Failed to publish prediction: {model=} {self.mr_id=}")
+                    error = ex
+            if error is not None:
+                failures.append((model, error))
+        if failures and not published and not is_final_attempt() and is_retryable(failures[0][1]):
+            # 全部因临时故障失败时交由任务队列重新执行，不发布失败的评论
+            raise failures[0][1]
+        for model, error in failures:
+            # 重试之后仍然失败时明确告知，而不是静默地没有结果（异常的详细信息只记录在日志中）
+            await asyncio.to_thread(self.git_provider.publish_comment, f"{model}: 调用AI模型失败，请稍后重试")
+        if failures and not published:
+            raise failures[0][1]
+
+    def _publish(self, model, prediction):
+        """
+        发布一个模型的预测结果
+
+        Args:
+            model (str):
+            prediction (str):
+
+        Returns:
+            None
+        """
+        if data := load_yaml(prediction):
+            self.subclass_run(model, data)
+        else:
+            # 不是预期的结构但是有响应数据也直接添加评论，不能浪费
+            self.git_provider.publish_comment(f"{model}:{prediction}")
 
     def subclass_run(self, model, data):
         """
@@ -78,57 +116,186 @@ class CommandBase:
         """
         raise NotImplemented
 
-    @call_with_retry
-    async def generate_prediction(self):
+    def subclass_progress(self, model, data):
         """
-        调用AI模型预测(响应结果直接存储在self.prediction中)
+        流式模式下根据已经完整输出的部分数据生成执行中临时评论的内容（子类可按需覆盖）
+
+        Args:
+            model (str):
+            data (dict): 已完整输出的部分
 
         Returns:
-            None
+            str | None: 返回None表示不更新
         """
-        if prediction := await self._prediction():
-            self.prediction[AiHandler.model] = prediction.strip()
+        if markdown := convert_to_markdown(data):
+            return f"{RUNNING_COMMENT}\n\n{markdown}"
 
-    async def _prediction(self):
+    async def generate_prediction(self, handler, prompts):
         """
-        实际调用AI模型生成响应数据的方法
+        调用一个AI模型预测（一个模型失败不影响其他模型）
+
+        Args:
+            handler (AiHandler):
+            prompts (list[tuple[str, str]]): 每一批的(system prompt, user prompt)
 
         Returns:
-            str: AI预测的字符串。
+            tuple[str, str | None, Exception | None]: 模型名称, AI预测的字符串, 失败时的异常
         """
         try:
-            variables = copy.deepcopy(self.variables)
-            environment = Environment(undefined=StrictUndefined)
-            system_prompt = environment.from_string(self.system_template).render(variables)
-            user_prompt = environment.from_string(self.user_template).render(variables)
-            # 目前的system_prompt和user_prompt还没有diff信息
-            token_handler = TokenHandler(system_prompt, user_prompt)
-            variables["diff"] = get_diff(self.git_provider, token_handler, False, self.params.patch_extra_lines)
-            variables["description"] = self.git_provider.get_description(token_handler)
-            variables["commit_messages_str"] = self.git_provider.get_commit_messages(token_handler)
-            # 带上diff信息后的完整prompt
-            system_prompt = environment.from_string(self.system_template).render(variables)
-            user_prompt = environment.from_string(self.user_template).render(variables)
-
-            logger.debug(f"\nSystem prompt:\n{system_prompt}")
-            logger.debug(f"\nUser prompt:\n{user_prompt}")
-
-            if not os.path.exists(f"{AiHandler.model}_response.pkl"):
-                response = await AiHandler.chat_completion(
-                    temperature=self.params.ai_temperature,
-                    system=system_prompt,
-                    user=user_prompt,
+            prediction = await self._prediction(handler, prompts)
+        except Exception as ex:
+            logger.exception(f"AI prediction failed: {handler.model=} {self.mr_id=}")
+            return handler.model, None, ex
+        return handler.model, prediction.strip() if prediction else None, None
+
+    def _build_prompts(self):
+        """
+        生成带有diff信息的完整prompt（所有模型共用，diff超出tokens上限并且开启分批时有多批）
+
+        Returns:
+            list[tuple[str, str]]: 每一批的(system prompt, user prompt)
+        """
+        variables = copy.deepcopy(self.variables)
+        environment = Environment(undefined=StrictUndefined)
+        system_prompt = environment.from_string(self.system_template).render(variables)
+        user_prompt = environment.from_string(self.user_template).render(variables)
+        # 目前的system_prompt和user_prompt还没有diff信息
+        token_handler = TokenHandler(system_prompt, user_prompt)
+        variables["description"] = self.git_provider.get_description(token_handler)
+        variables["commit_messages_str"] = self.git_provider.get_commit_messages(token_handler)
+        if self.params.chunked:
+            diffs = get_diff_batches(self.git_provider, token_handler, False, self.params.patch_extra_lines)
+        else:
+            diffs = [get_diff(self.git_provider, token_handler, False, self.params.patch_extra_lines)]
+        # 带上diff信息后的完整prompt
+        prompts = []
+        for diff in diffs:
+            variables["diff"] = diff
+            prompts.append(
+                (
+                    environment.from_string(self.system_template).render(variables),
+                    environment.from_string(self.user_template).render(variables),
                 )
-                # DEBUG的时候使用响应暂存的方式减少不必要的AI调用
-                # pickle.dump(response, open(f'{handler.model}_response.pkl', 'wb'))
-            else:
-                response = pickle.load(open(f"{AiHandler.model}_response.pkl", "rb"))
+            )
+        return prompts
+
+    async def _prediction(self, handler, prompts):
+        """
+        实际调用AI模型生成响应数据的方法
+
+        Args:
+            handler (AiHandler):
+            prompts (list[tuple[str, str]]): 每一批的(system prompt, user prompt)
 
-            logger.debug(f"AI response {AiHandler.model}:\n{response}")
+        Returns:
+            str: AI预测的字符串。
+        """
+        if len(prompts) == 1:
+            # 只有主模型流式更新执行中的临时评论，避免多个模型互相覆盖
+            stream = self.params.stream and handler is AI_HANDLERS[0]
+            return await self._complete(handler, *prompts[0], stream=stream)
+
+        # 各批次并发调用，总耗时接近单次调用；部分批次失败时合并其余批次的结果
+        logger.info(f"MR超出tokens上限，{handler.model}分{len(prompts)}批并发预测: {self.mr_id=}")
+        responses = await asyncio.gather(
+            *(self._complete(handler, system, user) for system, user in prompts), return_exceptions=True
+        )
+        if errors := [response for response in responses if isinstance(response, Exception)]:
+            logger.warning(f"{handler.model}有{len(errors)}批预测失败: {self.mr_id=} {errors=}")
+        datas = [
+            data
+            for response in responses
+            if isinstance(response, str) and isinstance(data := load_yaml(response), dict)
+        ]
+        if datas:
+            return dump_yaml(self.merge_data(datas))
+        if errors:
+            raise errors[0]
+
+    @call_with_retry
+    async def _complete(self, handler, system_prompt, user_prompt, stream=False):
+        """
+        使用最终的prompt调用AI模型（优先使用缓存的响应，临时故障时按退避策略重试）
+
+        Args:
+            handler (AiHandler):
+            system_prompt (str):
+            user_prompt (str):
+            stream (bool): 是否流式调用
+
+        Returns:
+            str | None: AI预测的字符串。
+        """
+        logger.debug(f"\nSystem prompt:\n{system_prompt}")
+        logger.debug(f"\nUser prompt:\n{user_prompt}")
 
+        cache_key = ResponseCache.make_key(handler.model, self.params.ai_temperature, system_prompt, user_prompt)
+        if RESPONSE_CACHE and (response := await asyncio.to_thread(RESPONSE_CACHE.get, cache_key)):
+            logger.info(f"AI response cache hit: {self.mr_id=}")
             return response
-        except Exception as ex:
-            logger.exception(ex)
+
+        if stream:
+            response = await self._stream_prediction(handler, system_prompt, user_prompt)
+        else:
+            response = await handler.chat_completion(
+                temperature=self.params.ai_temperature,
+                system=system_prompt,
+                user=user_prompt,
+            )
+        # 只缓存能正常解析的响应，避免错误的结果被反复使用
+        if RESPONSE_CACHE and response and load_yaml(response):
+            await asyncio.to_thread(RESPONSE_CACHE.set, cache_key, response)
+
+        logger.debug(f"AI response {handler.model}:\n{response}")
+
+        return response
+
+    def merge_data(self, datas):
+        """
+        合并分批预测的结果（子类可按需覆盖，处理评分等需要特殊合并的字段）
+
+        Args:
+            datas (list[dict]): 各批次解析后的预测结果
+
+        Returns:
+            dict
+        """
+        return merge_yaml_data(datas)
+
+    async def _stream_prediction(self, handler, system_prompt, user_prompt):
+        """
+        流式调用AI模型，每当有新的段落输出完整时原地更新执行中的临时评论；
+        已完整的部分超过stream_abort_chars仍无法解析时认为输出格式错误，提前终止生成。
+
+        Args:
+            handler (AiHandler):
+            system_prompt (str):
+            user_prompt (str):
+
+        Returns:
+            str: AI预测的字符串。
+        """
+        response = progress = ""
+        completed_chars = 0
+        stream = handler.chat_completion_stream(system_prompt, user_prompt, self.params.ai_temperature)
+        async with contextlib.aclosing(stream):
+            async for content in stream:
+                response += content
+                if "\n" not in content:
+                    # 只有出现新行时才可能有新的段落完成
+                    continue
+                data, chars = load_yaml_completed(response)
+                if chars <= completed_chars:
+                    continue
+                if data is None:
+                    if chars > CONFIG.config.stream_abort_chars:
+                        raise ValueError(f"AI response is not valid YAML, abort after {len(response)} chars")
+                    continue
+                completed_chars = chars
+                if (current := self.subclass_progress(handler.model, data)) and current != progress:
+                    progress = current
+                    await asyncio.to_thread(self.git_provider.update_temporary_comment, progress)
+        return response
 
     @staticmethod
     def get_labels(data):
@@ -82,6 +82,17 @@ class CommandDescribe(CommandBase):
         else:
             self.git_provider.publish_description(title, body)
 
+    def merge_data(self, datas):
+        merged = super(CommandDescribe, self).merge_data(datas)
+        # 各批次的描述只涉及部分差异，需要拼接
+        if descriptions := [data[CONSTANTS.DESCRIPTION] for data in datas if data.get(CONSTANTS.DESCRIPTION)]:
+            merged[CONSTANTS.DESCRIPTION] = "\n".join(map(str, descriptions))
+        if isinstance(merged.get(CONSTANTS.MAIN_FILES_WALKTHROUGH), list):
+            merged[CONSTANTS.MAIN_FILES_WALKTHROUGH] = merged[CONSTANTS.MAIN_FILES_WALKTHROUGH][
+                : self.params.num_walkthrough
+            ]
+        return merged
+
     def _prepare_answer(self, data):
         """
         根据AI预测数据准备MR描述。
@@ -1,3 +1,5 @@
+import asyncio
+
 from ._commands_base import *
 from .describe import CommandDescribe
 from .describe import CommandDescribeParams
@@ -32,7 +34,9 @@ class CommandHelp(CommandBase):
                 comment += self.get_help_text()
             else:
                 comment += get_help_text(CommandType.Review)
-        self.git_provider.publish_persistent_comment(comment, initial_header=f"## 使用帮助", update_header=False)
+        await asyncio.to_thread(
+            self.git_provider.publish_persistent_comment, comment, initial_header=f"## 使用帮助", update_header=False
+        )
 
     @staticmethod
     def get_help_text():
@@ -1,3 +1,5 @@
+import asyncio
+import re
 from collections import OrderedDict
 
 from ._commands_base import *
@@ -165,6 +167,7 @@ class CommandReviewParams(CommandParams):
     enable_review_labels_security: bool = Field(True, description="发现安全问题是否需要打个标签")
     enable_review_labels_estimate: bool = Field(False, description="评估MR耗费的时间是否需要打个标签")
     persistent_comment: bool = Field(True, description="持续更新同一个评论")
+    incremental: bool = Field(False, description="增量审查：只审查上次审查之后新增的提交")
 
 
 class CommandReview(CommandBase):
@@ -173,16 +176,103 @@ class CommandReview(CommandBase):
 
     def __init__(self, git_provider, params, **kwargs):
         super(CommandReview, self).__init__(git_provider, params)
+        self.head_sha = self.git_provider.mr.diff_refs["head_sha"]
+        self.base_sha = self.git_provider.mr.diff_refs["base_sha"]
+        self.reviewed_sha = None
+        if self.params.incremental:
+            # 每个模型各自记录审查过的版本，所有模型都审查过同一个版本时才能增量审查
+            headers = [self._get_headers(handler.model) for handler in AI_HANDLERS]
+            reviewed = {self.git_provider.get_last_reviewed_version(h) for h in headers}
+            reviewed_head, reviewed_base = (reviewed.pop() if len(reviewed) == 1 else None) or (None, None)
+            if reviewed_head == self.head_sha:
+                self.reviewed_sha = reviewed_head
+            elif reviewed_head and reviewed_base != self.base_sha:
+                # 变基到新的目标分支之后两个版本之间的差异会包含目标分支的修改，只能完整审查
+                logger.info(f"MR的基准已变化，完整审查: {self.git_provider.mr_id} {reviewed_base=} {self.base_sha=}")
+            elif reviewed_head and self.git_provider.set_diff_base(reviewed_head):
+                # 差异只包含上次审查的版本与当前版本之间的修改，上次审查的版本不可达时完整审查
+                self.reviewed_sha = reviewed_head
+                self.variables["extra_instructions"] = (
+                    f"本次为增量审查，差异部分只包含提交{self.reviewed_sha[:8]}之后新增的修改。\n"
+                    f"{self.variables['extra_instructions']}"
+                )
+
+    async def run(self):
+        if self.params.incremental and self.reviewed_sha == self.head_sha:
+            await asyncio.to_thread(
+                self.git_provider.publish_comment, f"提交 {self.head_sha[:8]} 已经审查过，没有新的修改需要审查"
+            )
+            return
+        await super(CommandReview, self).run()
+
+    @staticmethod
+    def _get_header(model):
+        return f"## {CONSTANTS.ANALYSIS}({model})"
+
+    @staticmethod
+    def _get_incremental_header(model):
+        return f"## 增量{CONSTANTS.ANALYSIS}({model})"
+
+    @classmethod
+    def _get_headers(cls, model):
+        """
+        记录了审查版本的评论标题（完整审查以及增量审查）
+        """
+        return cls._get_header(model), cls._get_incremental_header(model)
 
     def subclass_run(self, model, data):
         comment = self._prepare_review(model, data)
-        if self.params.persistent_comment:
+        if skipped := self.git_provider.skipped_files:
+            # 获取差异时跳过的文件没有经过审查，折叠列在审查结果中
+            files = "\n".join(f"- `{filename}`（{reason}）" for filename, reason in skipped)
+            summary = f"跳过了{len(skipped)}个生成的文件、第三方代码以及依赖锁文件"
+            comment += f"\n\n<details><summary>{summary}</summary>\n\n{files}\n</details>"
+        # 记录本次审查的版本，供下次增量审查使用
+        comment += f"\n\n{REVIEWED_MARKER.format(head_sha=self.head_sha, base_sha=self.base_sha)}"
+        if self.reviewed_sha:
+            # 增量审查只覆盖新增的修改，单独发布评论，不覆盖完整审查的持续评论
+            header, incremental_header = self._get_headers(model)
+            note = f"\n\n> 本次只审查了提交 {self.reviewed_sha[:8]} 之后新增的修改，完整的审查结果见之前的评论"
+            self.git_provider.publish_comment(comment.replace(header, incremental_header + note, 1))
+        elif self.params.persistent_comment:
             self.git_provider.publish_persistent_comment(
-                comment, initial_header=f"## {CONSTANTS.ANALYSIS}({model})", update_header=True
+                comment, initial_header=self._get_header(model), update_header=True
             )
         else:
             self.git_provider.publish_comment(comment)
 
+    def merge_data(self, datas):
+        merged = super(CommandReview, self).merge_data(datas)
+        analyses = [data.get(CONSTANTS.ANALYSIS) or {} for data in datas]
+        feedbacks = [data.get(CONSTANTS.MR_FEEDBACK) or {} for data in datas]
+        analysis = merged.get(CONSTANTS.ANALYSIS) or {}
+        mr_feedback = merged.get(CONSTANTS.MR_FEEDBACK) or {}
+
+        # 各批次只看到了部分差异，总结和建议需要拼接，评分取最低、评估取最高，存在问题的回答优先
+        if summaries := [a[CONSTANTS.SUMMARY] for a in analyses if a.get(CONSTANTS.SUMMARY)]:
+            analysis[CONSTANTS.SUMMARY] = "\n".join(summaries)
+        if scores := [a[CONSTANTS.SCORE] for a in analyses if a.get(CONSTANTS.SCORE)]:
+            analysis[CONSTANTS.SCORE] = min(scores, key=lambda x: _leading_number(x, 10))
+        if estimates := [a[CONSTANTS.REVIEW_ESTIMATED] for a in analyses if a.get(CONSTANTS.REVIEW_ESTIMATED)]:
+            analysis[CONSTANTS.REVIEW_ESTIMATED] = max(estimates, key=lambda x: _leading_number(x, 0))
+        for key, answer in (
+            (CONSTANTS.ERROR, "是"),
+            (CONSTANTS.SECURITY_CONCERNS, "是"),
+            (CONSTANTS.TESTS, "是"),
+            (CONSTANTS.FOCUSED, "否"),
+        ):
+            answers = [str(a[key]) for a in analyses if a.get(key)]
+            if matched := [x for x in answers if x.startswith(answer)]:
+                analysis[key] = "\n".join(matched)
+
+        if suggestions := [f[CONSTANTS.GENERAL_SUGGESTIONS] for f in feedbacks if f.get(CONSTANTS.GENERAL_SUGGESTIONS)]:
+            mr_feedback[CONSTANTS.GENERAL_SUGGESTIONS] = "\n".join(suggestions)
+        if isinstance(mr_feedback.get(CONSTANTS.CODE_SUGGESTIONS), list):
+            mr_feedback[CONSTANTS.CODE_SUGGESTIONS] = mr_feedback[CONSTANTS.CODE_SUGGESTIONS][
+                : self.params.num_code_suggestions
+            ]
+        return merged
+
     def _prepare_review(self, model, data):
         # 给最上面的title后附加使用的model
         analysis_key = f"{CONSTANTS.ANALYSIS}({model})"
@@ -256,3 +346,18 @@ class CommandReview(CommandBase):
             if not label.startswith(CONSTANTS.REVIEW_ESTIMATED) and not label.startswith(CONSTANTS.SECURITY_CONCERNS)
         ]
         return review_labels + current_labels
+
+
+def _leading_number(text, default):
+    """
+    获取"9, 因为..."格式回答开头的数字
+
+    Args:
+        text (str):
+        default (int): 没有数字时的默认值
+
+    Returns:
+        int
+    """
+    match = re.match(r"\s*(\d+)", str(text))
+    return int(match.group(1)) if match else default
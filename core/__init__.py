@@ -1,13 +1,43 @@
+from .ai import AI_HANDLERS
 from .ai import AiHandler
+from .cache import RESPONSE_CACHE
+from .cache import ResponseCache
 from .diff import get_diff
+from .diff import get_diff_batches
+from .git_mirror import create_git_provider
+from .git_mirror import GitMirror
+from .git_mirror import MirrorGitProvider
 from .git_provider import get_main_language
 from .git_provider import GitProvider
+from .git_provider import REVIEWED_MARKER
+from .ignore import get_ignore_matcher
+from .ignore import IgnoreMatcher
+from .job_queue import is_final_attempt
+from .job_queue import JobQueue
+from .job_queue import tag_current_job
+from .single_flight import SingleFlight
+from .tokens import get_encoder
 from .tokens import TokenHandler
 
 __all__ = [
+    "AI_HANDLERS",
     "AiHandler",
+    "RESPONSE_CACHE",
+    "ResponseCache",
+    "REVIEWED_MARKER",
+    "create_git_provider",
     "get_diff",
+    "get_diff_batches",
+    "get_encoder",
+    "get_ignore_matcher",
+    "GitMirror",
     "GitProvider",
+    "IgnoreMatcher",
+    "is_final_attempt",
     "get_main_language",
+    "JobQueue",
+    "MirrorGitProvider",
+    "SingleFlight",
+    "tag_current_job",
     "TokenHandler",
 ]
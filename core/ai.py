@@ -1,26 +1,188 @@
-import requests
+import asyncio
+import json
 
+import httpx
+
+from .endpoint_pool import EndpointPool
 from defines import *
+from utils import *
 
 
 class AiHandler:
     """
-    AI处理模型基类，具体的AI调用在子类中完成
+    AI模型的调用：每个实例对应一个配置的模型（可以有多个推理服务地址），所有实例共享同一个HTTP连接池
     """
 
-    model = CONFIG.ai.model
+    _client: httpx.AsyncClient | None = None
+
+    def __init__(self, model, urls, key, timeout=None):
+        """
+
+        Args:
+            model (str): 模型名称
+            urls (list[str]): OpenAI兼容的chat completions接口地址（多个地址之间负载均衡）
+            key (str): 接口密钥
+            timeout (int | None): 单次调用的超时时间(秒)，默认使用ai_timeout
+        """
+        self.model = model
+        self.pool = EndpointPool(urls, _is_endpoint_failure)
+        self.key = key
+        self.timeout = timeout or CONFIG.config.ai_timeout
+
+    @classmethod
+    def get_client(cls):
+        """
+        获取进程内共享的异步HTTP客户端（懒加载，连接池在所有请求间复用并保持长连接）
+
+        Returns:
+            httpx.AsyncClient
+        """
+        if cls._client is None or cls._client.is_closed:
+            cls._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(CONFIG.config.ai_timeout, connect=CONFIG.config.ai_connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=CONFIG.config.ai_max_connections,
+                    max_keepalive_connections=CONFIG.config.ai_max_connections,
+                    keepalive_expiry=CONFIG.config.ai_keepalive_expiry,
+                ),
+            )
+        return cls._client
+
+    @classmethod
+    async def close(cls):
+        """
+        关闭共享的HTTP客户端（应用退出时调用）
+
+        Returns:
+            None
+        """
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client = None
+
+    def _http_timeout(self):
+        return httpx.Timeout(self.timeout, connect=CONFIG.config.ai_connect_timeout)
+
+    def _build_request(self, system, user, temperature, stream):
+        """
+        构造调用AI接口的请求体和请求头
 
-    @staticmethod
-    async def chat_completion(system, user, temperature=1.0):
+        Returns:
+            tuple[dict, dict]: body, headers
+        """
         messages = [{"role": "system", "content": system}, {"role": "user", "content": user}]
         body = {
-            "model": CONFIG.ai.model,
-            "stream": False,
+            "model": self.model,
+            "stream": stream,
             "temperature": temperature,
             "messages": messages,
         }
-        headers = {"Content-Type": "application/json", "Authorization": f"Bearer {CONFIG.ai.key}"}
-        response = requests.post(CONFIG.ai.url, json=body, headers=headers)
-        if response.ok:
-            data = response.json()
-            return data["choices"][0]["message"]["content"]
+        headers = {"Content-Type": "application/json", "Authorization": f"Bearer {self.key}"}
+        return body, headers
+
+    async def chat_completion(self, system, user, temperature=1.0):
+        """
+        调用AI模型（整个调用受模型的超时时间限制，超时抛出TimeoutError，响应失败抛出httpx.HTTPStatusError）
+
+        Args:
+            system (str): system prompt
+            user (str): user prompt
+            temperature (float): 模型温度
+
+        Returns:
+            str: AI响应的内容
+        """
+        body, headers = self._build_request(system, user, temperature, False)
+
+        async def request(url):
+            response = await self.get_client().post(url, json=body, headers=headers, timeout=self._http_timeout())
+            self._raise_for_status(response)
+            return response.json()["choices"][0]["message"]["content"]
+
+        return await self.pool.call(request, self.timeout)
+
+    async def chat_completion_stream(self, system, user, temperature=1.0):
+        """
+        以流式(SSE)方式调用AI模型，逐段返回生成的内容（整个调用同样受模型的超时时间限制）
+
+        Args:
+            system (str): system prompt
+            user (str): user prompt
+            temperature (float): 模型温度
+
+        Yields:
+            str: 新生成的内容片段
+        """
+        body, headers = self._build_request(system, user, temperature, True)
+        deadline = asyncio.get_running_loop().time() + self.timeout
+        async with self.pool.lease() as endpoint:
+            stream = self.get_client().stream(
+                "POST", endpoint.url, json=body, headers=headers, timeout=self._http_timeout()
+            )
+            async with stream as response:
+                if not response.is_success:
+                    await response.aread()
+                    self._raise_for_status(response)
+                async for line in response.aiter_lines():
+                    if asyncio.get_running_loop().time() > deadline:
+                        raise TimeoutError(f"AI stream of {self.model} exceeded {self.timeout}s")
+                    if not line.startswith("data:"):
+                        continue
+                    if (payload := line[5:].strip()) == "[DONE]":
+                        break
+                    choices = json.loads(payload).get("choices") or [{}]
+                    if content := choices[0].get("delta", {}).get("content"):
+                        yield content
+
+    def _raise_for_status(self, response):
+        """
+        响应失败时记录响应内容并抛出httpx.HTTPStatusError（由调用方按状态码决定是否重试）
+
+        Args:
+            response (httpx.Response):
+
+        Returns:
+            None
+        """
+        if not response.is_success:
+            logger.error(f"AI request failed: {self.model=} {response.status_code=} {response.text=}")
+            response.raise_for_status()
+
+    def stats(self):
+        """
+        模型各推理服务地址的状态
+
+        Returns:
+            dict
+        """
+        return {"model": self.model, "endpoints": self.pool.stats()}
+
+
+def _is_endpoint_failure(ex):
+    """
+    判断请求异常是否属于服务端的故障（请求本身错误的4xx不计入熔断，429限流计入）
+
+    Args:
+        ex (Exception):
+
+    Returns:
+        bool
+    """
+    if isinstance(ex, httpx.HTTPStatusError):
+        status = ex.response.status_code
+        return status == 429 or status >= 500
+    return True
+
+
+def _load_handlers():
+    """
+    根据配置创建所有模型的AiHandler（[ai]为主模型，[[ai.models]]为额外并发调用的模型）
+
+    Returns:
+        list[AiHandler]
+    """
+    configs = [CONFIG.ai, *CONFIG.ai.get("models", [])]
+    return [AiHandler(c["model"], c.get("urls") or [c["url"]], c["key"], c.get("timeout")) for c in configs]
+
+
+AI_HANDLERS = _load_handlers()
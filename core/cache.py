@@ -0,0 +1,138 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from config import CONFIG
+from utils import *
+
+# 命中时accessed_at的最小刷新间隔(秒)，LRU淘汰不需要精确到每次访问，避免每次命中都写库
+TOUCH_INTERVAL = 60
+
+
+class ResponseCache:
+    """
+    AI响应缓存：以模型、温度以及最终prompt的哈希作为key，持久化在SQLite中，按TTL和条目上限淘汰
+    读写都是阻塞的SQLite操作，在协程中需要通过asyncio.to_thread调用
+    """
+
+    def __init__(self, path, ttl, max_entries):
+        """
+
+        Args:
+            path (str): SQLite数据库文件路径
+            ttl (int): 缓存有效期(秒)
+            max_entries (int): 最多保留的缓存条目数，超出后淘汰最久未访问的条目
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if directory := os.path.dirname(path):
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ai_response ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_ai_response_accessed ON ai_response (accessed_at)")
+
+    @staticmethod
+    def make_key(model, temperature, system, user):
+        """
+        生成缓存key
+
+        Args:
+            model (str):
+            temperature (float):
+            system (str): 最终的system prompt
+            user (str): 最终的user prompt
+
+        Returns:
+            str
+        """
+        digest = hashlib.sha256()
+        for part in (model, repr(float(temperature)), system, user):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        查询缓存（过期的条目视为未命中）
+
+        Args:
+            key (str):
+
+        Returns:
+            str | None
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, accessed_at FROM ai_response WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            response, accessed_at = row
+            if now - accessed_at >= TOUCH_INTERVAL:
+                self._conn.execute("UPDATE ai_response SET accessed_at = ? WHERE key = ?", (now, key))
+            return response
+
+    def set(self, key, response):
+        """
+        写入缓存并淘汰过期以及超出上限的条目
+
+        Args:
+            key (str):
+            response (str):
+
+        Returns:
+            None
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("INSERT OR REPLACE INTO ai_response VALUES (?, ?, ?, ?)", (key, response, now, now))
+                self._conn.execute("DELETE FROM ai_response WHERE created_at <= ?", (now - self.ttl,))
+                self._conn.execute(
+                    "DELETE FROM ai_response WHERE key NOT IN "
+                    "(SELECT key FROM ai_response ORDER BY accessed_at DESC LIMIT ?)",
+                    (self.max_entries,),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def stats(self):
+        """
+        缓存的统计信息
+
+        Returns:
+            dict
+        """
+        with self._lock:
+            (size,) = self._conn.execute("SELECT COUNT(*) FROM ai_response").fetchone()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": size,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+        }
+
+
+RESPONSE_CACHE = (
+    ResponseCache(CONFIG.cache.path, CONFIG.cache.ttl, CONFIG.cache.max_entries) if CONFIG.cache.enable else None
+)
@@ -0,0 +1,295 @@
+import re
+from collections import Counter
+from dataclasses import dataclass
+
+from config import CONFIG
+from utils import *
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@[ ]?(.*)")
+# 导入语句（调整顺序不影响语义）
+_IMPORT_LINE = re.compile(r"^\s*(import\s|from\s+\S+\s+import\s|#\s*include\s|using\s|use\s|require[\s(])|^\s*$")
+# 缩进有语义的文件，只忽略行尾的空白字符
+_INDENT_SENSITIVE = re.compile(r"\.(py|pyi|yaml|yml|coffee|pug|haml|sass|nim)$|(^|/)(Makefile|[^/]*\.mk)$")
+
+
+@dataclass
+class _PatchLine:
+    kind: str  # " " | "+" | "-" | "\\"
+    text: str  # 不含前缀的内容
+    old: int  # 该行在旧文件中的位置（新增的行为下一个旧行的位置）
+    new: int  # 该行在新文件中的位置（删除的行为下一个新行的位置）
+    keep: bool = True
+
+
+@dataclass
+class _Hunk:
+    section: str
+    lines: list[_PatchLine]
+
+
+def _normalizer(filename):
+    """
+    比较代码行时忽略空白字符的方式：只忽略行首和行尾的空白（行内的空白可能在字符串字面量中），
+    缩进有语义的文件只忽略行尾的空白
+
+    Args:
+        filename (str):
+
+    Returns:
+        Callable[[str], str]
+    """
+    return str.rstrip if _INDENT_SENSITIVE.search(filename) else str.strip
+
+
+def _parse(patch):
+    """
+    解析补丁，记录每一行在新旧文件中的位置
+
+    Args:
+        patch (str):
+
+    Returns:
+        list[_Hunk] | None: 无法解析时为None
+    """
+    hunks = []
+    old = new = 0
+    for line in patch.splitlines():
+        if line.startswith("@@"):
+            if not (match := _HUNK_HEADER.match(line)):
+                return None
+            old, new = int(match.group(1)), int(match.group(3))
+            hunks.append(_Hunk(match.group(5), []))
+            continue
+        if not hunks:
+            return None
+        kind = line[:1] if line[:1] in ("+", "-", "\\") else " "
+        hunks[-1].lines.append(_PatchLine(kind, line[1:], old, new))
+        if kind in (" ", "-"):
+            old += 1
+        if kind in (" ", "+"):
+            new += 1
+    return hunks
+
+
+def _trim_context(hunks, context_lines):
+    """
+    标记距离保留的修改超过context_lines的上下文为省略（修改被省略后其两侧的上下文也随之省略）
+
+    Args:
+        hunks (list[_Hunk]):
+        context_lines (int): 修改前后保留的上下文行数
+
+    Returns:
+        None
+    """
+    for hunk in hunks:
+        changes = [i for i, line in enumerate(hunk.lines) if line.kind in ("+", "-") and line.keep]
+        for i, line in enumerate(hunk.lines):
+            if line.kind == " " and line.keep:
+                line.keep = any(abs(i - j) <= context_lines for j in changes)
+            elif line.kind == "\\":
+                line.keep = i > 0 and hunk.lines[i - 1].keep
+
+
+def _render_changed(hunks, patch):
+    """
+    有行被省略时重新生成补丁，否则返回原补丁
+
+    Args:
+        hunks (list[_Hunk]):
+        patch (str): 原补丁
+
+    Returns:
+        str
+    """
+    return _render(hunks) if any(not line.keep for hunk in hunks for line in hunk.lines) else patch
+
+
+def _render(hunks):
+    """
+    生成补丁：被省略的行两侧的内容拆分为独立的hunk并重新计算hunk头
+
+    Args:
+        hunks (list[_Hunk]):
+
+    Returns:
+        str
+    """
+    result = []
+    for hunk in hunks:
+        segment = []
+        for line in [*hunk.lines, None]:
+            if line is not None and line.keep:
+                segment.append(line)
+                continue
+            if any(x.kind in ("+", "-") for x in segment):
+                old_count = sum(1 for x in segment if x.kind in (" ", "-"))
+                new_count = sum(1 for x in segment if x.kind in (" ", "+"))
+                old_start = segment[0].old if old_count else segment[0].old - 1
+                new_start = segment[0].new if new_count else segment[0].new - 1
+                result.append(f"@@ -{old_start},{old_count} +{new_start},{new_count} @@ {hunk.section}".rstrip())
+                result.extend(f"{x.kind}{x.text}" for x in segment)
+            segment = []
+    return "\n".join(result)
+
+
+def _collapse_noise_hunks(filename, hunks, notes):
+    """
+    省略只涉及行首/行尾空白字符（缩进有语义的文件只考虑行尾空白）或者只调整了导入语句顺序的hunk
+
+    Args:
+        filename (str):
+        hunks (list[_Hunk]):
+        notes (list[str]): 文件的说明
+
+    Returns:
+        None
+    """
+    normalize = _normalizer(filename)
+    for hunk in hunks:
+        changed = [x for x in hunk.lines if x.kind in ("+", "-")]
+        deleted = [normalize(x.text) for x in changed if x.kind == "-"]
+        added = [normalize(x.text) for x in changed if x.kind == "+"]
+        if not deleted or not added:
+            continue
+        if deleted == added:
+            note = "只涉及空白字符的修改"
+        elif Counter(deleted) == Counter(added) and all(_IMPORT_LINE.match(x.text) for x in changed):
+            note = "只调整了导入语句顺序的修改"
+        else:
+            continue
+        for line in hunk.lines:
+            if line.kind in ("+", "-"):
+                line.keep = False
+        notes.append(f"第{hunk.lines[0].new}行附近{note}已省略")
+
+
+def _runs(hunks, kind):
+    """
+    获取所有连续的新增或者删除的行
+
+    Returns:
+        list[tuple[_Hunk, list[_PatchLine]]]
+    """
+    runs = []
+    for hunk in hunks:
+        run = []
+        for line in [*hunk.lines, None]:
+            if line is not None and line.kind == "\\":
+                continue
+            if line is not None and line.kind == kind and line.keep:
+                run.append(line)
+                continue
+            if len(run) >= CONFIG.config.compact_moved_lines:
+                runs.append((hunk, run))
+            run = []
+    return runs
+
+
+def _collapse_moved_blocks(parsed, notes):
+    """
+    识别在文件内或者文件之间移动的代码块（忽略行首/行尾空白字符后内容相同的连续行，缩进有语义的文件缩进必须相同），
+    删除和新增的两侧都替换为一行说明
+
+    Args:
+        parsed (dict[str, list[_Hunk]]): 文件名: hunk列表
+        notes (dict[str, list[str]]): 文件名: 说明
+
+    Returns:
+        None
+    """
+    size = CONFIG.config.compact_moved_lines
+    added_index = {}
+    for filename, hunks in parsed.items():
+        normalize = _normalizer(filename)
+        for hunk, run in _runs(hunks, "+"):
+            for i in range(len(run) - size + 1):
+                key = tuple(normalize(x.text) for x in run[i : i + size])
+                # 过短的内容（例如只有括号的行）容易误判
+                if sum(map(len, key)) >= size * 8:
+                    added_index.setdefault(key, []).append((filename, hunk, run, i))
+
+    for filename, hunks in parsed.items():
+        normalize = _normalizer(filename)
+        for hunk, run in _runs(hunks, "-"):
+            i = 0
+            while i <= len(run) - size:
+                key = tuple(normalize(x.text) for x in run[i : i + size])
+                target = next(
+                    (
+                        (target_file, target_run, j)
+                        for target_file, target_hunk, target_run, j in added_index.get(key, [])
+                        # 同一个hunk内的删除和新增通常是原地的修改（例如调整缩进），不视为移动
+                        if target_hunk is not hunk and all(x.keep for x in target_run[j : j + size])
+                    ),
+                    None,
+                )
+                if target is None:
+                    i += 1
+                    continue
+                target_file, target_run, j = target
+                target_normalize = _normalizer(target_file)
+                count = size
+                while (
+                    i + count < len(run)
+                    and j + count < len(target_run)
+                    and target_run[j + count].keep
+                    and normalize(run[i + count].text) == target_normalize(target_run[j + count].text)
+                ):
+                    count += 1
+                for line in [*run[i : i + count], *target_run[j : j + count]]:
+                    line.keep = False
+                old_start, new_start = run[i].old, target_run[j].new
+                notes[filename].append(
+                    f"第{old_start}-{old_start + count - 1}行的{count}行代码移动到了{target_file}第{new_start}行，已省略"
+                )
+                notes[target_file].append(
+                    f"第{new_start}-{new_start + count - 1}行的{count}行代码移动自{filename}第{old_start}行且内容未改变，已省略"
+                )
+                i += count
+
+
+def compact_patches(files, token_handler, context_budget=None):
+    """
+    在计算tokens之前压缩补丁中的噪音：省略只涉及空白字符或者只调整导入语句顺序的hunk，
+    将移动的代码块替换为一行说明，补丁超出tokens预算时再缩短过长的未修改上下文；每个文件节省的tokens会记录到日志中
+
+    Args:
+        files (list[FilePatchInfo]):
+        token_handler (TokenHandler):
+        context_budget (int | None): 所有补丁的tokens超出该值时才缩短上下文，None表示不缩短（例如需要扩展上下文时）
+
+    Returns:
+        dict[str, tuple[str, list[str]]]: 文件名: (压缩后的补丁, 需要放在文件头之后的说明)
+    """
+    result = {file.filename: (file.patch, []) for file in files}
+    if not CONFIG.config.compact_diff:
+        return result
+
+    parsed = {}
+    notes = {}
+    for file in files:
+        if file.patch and (hunks := _parse(file.patch)) is not None:
+            parsed[file.filename] = hunks
+            notes[file.filename] = []
+            _collapse_noise_hunks(file.filename, hunks, notes[file.filename])
+    _collapse_moved_blocks(parsed, notes)
+
+    compacted = {filename: _render_changed(hunks, result[filename][0]) for filename, hunks in parsed.items()}
+    if context_budget is not None:
+        patches = [compacted.get(filename, patch) for filename, (patch, _) in result.items() if patch]
+        if sum(token_handler.count_tokens_batch(patches)) > context_budget:
+            for filename, hunks in parsed.items():
+                _trim_context(hunks, CONFIG.config.compact_context_lines)
+                compacted[filename] = _render_changed(hunks, result[filename][0])
+    changed = [filename for filename in compacted if compacted[filename] != result[filename][0] or notes[filename]]
+    if not changed:
+        return result
+
+    before = token_handler.count_tokens_batch([result[filename][0] for filename in changed])
+    after = token_handler.count_tokens_batch([compacted[filename] + "".join(notes[filename]) for filename in changed])
+    for filename, old_tokens, new_tokens in zip(changed, before, after):
+        result[filename] = (compacted[filename], notes[filename])
+        logger.info(f"Compacted {filename}: {old_tokens} -> {new_tokens} tokens ({old_tokens - new_tokens} saved)")
+    logger.info(f"Diff compaction saved {sum(before) - sum(after)} tokens in {len(changed)} files")
+    return result
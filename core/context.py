@@ -0,0 +1,83 @@
+import threading
+import time
+from collections import OrderedDict
+
+from config import CONFIG
+
+
+class MergeRequestContext:
+    """
+    同一个MR（同一个head sha）在多个命令之间共享的GitLab API结果，每项数据只会加载一次
+    """
+
+    def __init__(self):
+        self.created_at = time.monotonic()
+        self._values = {}
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def get(self, name, loader):
+        """
+        获取指定的数据，不存在时调用loader加载（同名数据并发加载时只会有一个实际执行）
+
+        Args:
+            name (str): 数据名称
+            loader (Callable[[], Any]): 加载函数
+
+        Returns:
+            Any
+        """
+        with self._guard:
+            if name in self._values:
+                return self._values[name]
+            lock = self._locks.setdefault(name, threading.Lock())
+        with lock:
+            if name not in self._values:
+                self._values[name] = loader()
+            return self._values[name]
+
+    def peek(self, name):
+        """
+        获取已经加载的数据（不会触发加载）
+
+        Args:
+            name (str): 数据名称
+
+        Returns:
+            Any: 没有加载时为None
+        """
+        with self._guard:
+            return self._values.get(name)
+
+    @property
+    def expired(self):
+        return time.monotonic() - self.created_at > CONFIG.config.mr_context_ttl
+
+
+_CONTEXTS: OrderedDict[tuple, MergeRequestContext] = OrderedDict()
+_CONTEXTS_LOCK = threading.Lock()
+
+
+def get_merge_request_context(git_base, project_id, mr_id, head_sha):
+    """
+    获取MR的共享上下文（过期或者超出数量上限的上下文会被淘汰，head sha变化时自然使用新的上下文）
+
+    Args:
+        git_base (str): gitlab的地址
+        project_id (str):
+        mr_id (int):
+        head_sha (str):
+
+    Returns:
+        MergeRequestContext
+    """
+    key = (git_base, project_id, mr_id, head_sha)
+    with _CONTEXTS_LOCK:
+        for k in [k for k, v in _CONTEXTS.items() if v.expired]:
+            del _CONTEXTS[k]
+        if key not in _CONTEXTS:
+            _CONTEXTS[key] = MergeRequestContext()
+            while len(_CONTEXTS) > CONFIG.config.mr_context_max_size:
+                _CONTEXTS.popitem(last=False)
+        _CONTEXTS.move_to_end(key)
+        return _CONTEXTS[key]
@@ -1,7 +1,9 @@
-import fnmatch
 import re
 
+from .compaction import compact_patches
+from .generated import GENERATED_FILE_PATTERN
 from .git_provider import GitProvider
+from .ignore import get_ignore_matcher
 from .tokens import TokenHandler
 from defines import *
 from utils import *
@@ -9,9 +11,20 @@ from utils import *
 ADDED_FILES_ = "其他新增的文件:\n"
 DELETED_FILES_ = "其他删除的文件:\n"
 MODIFIED_FILES_ = "其他修改的文件:\n"
+PARTIAL_FILES_ = "其他部分修改被省略的文件:\n"
+SKIPPED_FILES_ = "跳过的生成文件、第三方代码以及依赖锁文件:\n"
 
 TOKENS_SOFT_BUFFER_THRESHOLD = 1000
-TOKENS_HARD_BUFFER_THRESHOLD = 600
+
+# 测试文件
+TEST_FILE_PATTERN = re.compile(r"(^|/)(tests?|__tests__|spec)/|(^|/)test_[^/]*$|[_.-](test|tests|spec)\.[^/.]+$")
+# 函数、类等定义的签名行（不含开头的+/-）
+SIGNATURE_PATTERN = re.compile(
+    r"\s*(?:(?:export|public|private|protected|internal|static|async|override|virtual|abstract|final|inline|pub)\s+)*"
+    r"(?:def|function|func|fn|fun|class|interface|struct|enum|trait|impl)\b"
+    r"|\s*(?!(?:if|for|while|switch|catch|return|else|new)\b)[\w<>\[\],*&:]+(?:\s+[\w<>\[\],*&:]+)*\s+\w+\s*\([^;]*\)"
+    r"\s*(?:const\s*)?(?:throws\s+[\w., ]+)?\{\s*$"
+)
 
 
 def get_diff(git, token_handler, add_line_numbers_to_hunks=False, patch_extra_lines=0):
@@ -27,6 +40,98 @@ def get_diff(git, token_handler, add_line_numbers_to_hunks=False, patch_extra_li
     Returns:
         str: 包含合并请求diff的字符串，如果需要，应用diff最小化技术。
     """
+    languages, patches, total_tokens, compacted = _prepare_patches(
+        git, token_handler, add_line_numbers_to_hunks, patch_extra_lines
+    )
+
+    # Step 4.没超阈值则返回全部差异, 否则对差异进行修剪
+    if total_tokens + TOKENS_SOFT_BUFFER_THRESHOLD < token_handler.max_tokens:
+        diff = "\n".join(full_patch for _, _, full_patch in patches)
+    else:
+        diff = _clip_diff(languages, compacted, token_handler, add_line_numbers_to_hunks)[0]
+    return diff + _format_skipped(git, token_handler)
+
+
+def get_diff_batches(git, token_handler, add_line_numbers_to_hunks=False, patch_extra_lines=0):
+    """
+    返回按tokens预算切分的多批diff字符串（没有超出限制时只有一批），用于分批审查超大的MR。
+    按审查价值排序后的顺序依次装入各批次，单个文件超出预算时按hunk拆分到多个批次，超出批次上限时修剪差异。
+
+    Args:
+        git (GitProvider): GitProvider实例
+        token_handler (TokenHandler): TokenHandler实例
+        add_line_numbers_to_hunks (bool): 是否向diff中的块添加行号。默认为False。
+        patch_extra_lines (int): 额外的上下文代码。
+
+    Returns:
+        list[str]: 每一批的diff字符串
+    """
+    languages, patches, total_tokens, compacted = _prepare_patches(
+        git, token_handler, add_line_numbers_to_hunks, patch_extra_lines
+    )
+    if total_tokens + TOKENS_SOFT_BUFFER_THRESHOLD < token_handler.max_tokens:
+        batches = ["\n".join(full_patch for _, _, full_patch in patches)]
+    else:
+        batches = _split_batches(languages, patches, compacted, token_handler, add_line_numbers_to_hunks)
+    batches[-1] += _format_skipped(git, token_handler)
+    return batches
+
+
+def _split_batches(languages, patches, compacted, token_handler, add_line_numbers_to_hunks):
+    """
+    按顺序将补丁装入各批次，单个文件超出预算时按hunk拆分到多个批次，超出批次上限时修剪差异
+
+    Args:
+        languages (list[LanguageInfo]):
+        patches (list[tuple[FilePatchInfo, str, str]]): (文件, 扩展后的补丁, 完整的补丁字符串)列表
+        compacted (dict[str, tuple[str, list[str]]]): 文件名: (压缩后的补丁, 说明)
+        token_handler (TokenHandler):
+        add_line_numbers_to_hunks (bool):
+
+    Returns:
+        list[str]: 每一批的diff字符串
+    """
+    budget = token_handler.max_tokens - token_handler.prompt_tokens - TOKENS_SOFT_BUFFER_THRESHOLD
+    batches = []
+    current, current_tokens = [], 0
+    for file, patch, full_patch in patches:
+        if file.tokens <= budget:
+            pieces = [(full_patch, file.tokens)]
+        else:
+            notes = compacted[file.filename][1]
+            pieces = _split_patch(file, patch, token_handler, budget, add_line_numbers_to_hunks, notes)
+        for piece, tokens in pieces:
+            if current and current_tokens + tokens > budget:
+                batches.append("\n".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += tokens
+    if current:
+        batches.append("\n".join(current))
+
+    max_batches = CONFIG.config.max_diff_batches
+    if len(batches) <= max_batches:
+        return batches
+    # 超出批次上限时按审查价值选择装入各批次的hunk，并在最后一批中列出被省略的文件
+    logger.warning(f"MR过大，共{len(batches)}批差异，按审查价值修剪为{max_batches}批")
+    return _clip_diff(languages, compacted, token_handler, add_line_numbers_to_hunks, max_batches)
+
+
+def _prepare_patches(git, token_handler, add_line_numbers_to_hunks, patch_extra_lines):
+    """
+    获取、过滤并按主要语言分组变更文件，生成每个文件带有扩展上下文的补丁并统计tokens，补丁按审查价值从高到低排列
+
+    Args:
+        git (GitProvider): GitProvider实例
+        token_handler (TokenHandler): TokenHandler实例
+        add_line_numbers_to_hunks (bool): 是否向diff中的块添加行号
+        patch_extra_lines (int): 额外的上下文代码
+
+    Returns:
+        tuple[list[LanguageInfo], list[tuple[FilePatchInfo, str, str]], int, dict[str, tuple[str, list[str]]]]:
+            排序后的语言分组, (文件, 扩展后的补丁, 完整的补丁字符串)列表, 包含prompt在内的总tokens,
+            文件名: (压缩后的补丁, 说明)
+    """
     # Step 1.获取差异文件
     try:
         diff_files = git.get_diff_files()
@@ -35,72 +140,148 @@ def get_diff(git, token_handler, add_line_numbers_to_hunks=False, patch_extra_li
         raise
 
     # Step 2.过滤忽略的文件
-    diff_files = _filter_ignored(diff_files)
+    diff_files = _filter_ignored(diff_files, git.project_id)
 
     # Step 3.按照主要语言对变更文件排序
     languages = _sort_files_by_main_languages(git.get_languages(), diff_files)
 
-    # Step 3.生成带有补丁扩展名的标准diff字符串
-    total_tokens = token_handler.prompt_tokens  # initial tokens
-    patches_extended = []
-    for lang in languages:
-        for file in lang.files:
-            if not (patch := file.patch):
-                continue
-            # extend each patch with extra lines of context
-            extended_patch = _extend_patch(file.base_file, patch, num_lines=patch_extra_lines)
-            full_extended_patch = f"\n\n## {file.filename}\n\n{extended_patch}\n"
-            if add_line_numbers_to_hunks:
-                full_extended_patch = _convert_to_hunks_with_lines_numbers(extended_patch, file)
-            patch_tokens = token_handler.count_tokens(full_extended_patch)
-            file.tokens = patch_tokens
-            total_tokens += patch_tokens
-            patches_extended.append(full_extended_patch)
+    # Step 4.压缩补丁中的噪音（文件的补丁在多个命令之间共享，不能直接修改file.patch）
+    # 超出预算时才缩短上下文，需要扩展上下文时不缩短
+    changed_files = [file for lang in languages for file in lang.files if file.patch]
+    budget = token_handler.max_tokens - token_handler.prompt_tokens - TOKENS_SOFT_BUFFER_THRESHOLD
+    compacted = compact_patches(changed_files, token_handler, None if patch_extra_lines > 0 else budget)
+
+    # Step 5.生成带有补丁扩展名的标准diff字符串（只有需要扩展上下文时才加载base版本的文件内容）
+    if patch_extra_lines > 0:
+        git.load_file_contents(changed_files, head=False)
+    patches = []
+    for file in changed_files:
+        patch, notes = compacted[file.filename]
+        if not patch and not notes:
+            continue
+        # extend each patch with extra lines of context
+        extended_patch = _extend_patch(file.base_file, patch, num_lines=patch_extra_lines)
+        full_extended_patch = _format_patch(file, extended_patch, add_line_numbers_to_hunks, notes)
+        patches.append((file, extended_patch, full_extended_patch))
+
+    # Step 6.按审查价值从高到低排列文件，模型先看到最有价值的修改
+    ranks = {file.filename: (lang.name, rank) for rank, lang in enumerate(languages) for file in lang.files}
+    scores = {
+        file.filename: _score_hunks(file, _parse_hunks(file, patch), *ranks[file.filename])
+        for file, patch, _ in patches
+    }
+    patches.sort(key=lambda item: scores[item[0].filename], reverse=True)
+
+    # 所有补丁一次性批量计算tokens
+    patch_tokens = token_handler.count_tokens_batch([full_patch for _, _, full_patch in patches])
+    for (file, _, _), tokens in zip(patches, patch_tokens):
+        file.tokens = tokens
+    total_tokens = token_handler.prompt_tokens + sum(patch_tokens)
+    return languages, patches, total_tokens, compacted
+
+
+def _format_patch(file, patch, add_line_numbers_to_hunks, notes=()):
+    """
+    生成带有文件名的补丁字符串，压缩补丁时产生的说明放在文件名之后
+
+    Args:
+        file (FilePatchInfo):
+        patch (str):
+        add_line_numbers_to_hunks (bool):
+        notes (Iterable[str]): 压缩补丁时产生的说明
+
+    Returns:
+        str
+    """
+    notes_str = "".join(f"（{note}）\n" for note in notes)
+    if add_line_numbers_to_hunks:
+        header = f"\n\n## {file.filename}\n"
+        return _convert_to_hunks_with_lines_numbers(patch, file).replace(header, header + notes_str, 1)
+    return f"\n\n## {file.filename}\n\n{notes_str}{patch}\n"
 
-    # Step 4.没超阈值则返回全部差异, 否则对差异进行修剪
-    if total_tokens + TOKENS_SOFT_BUFFER_THRESHOLD < token_handler.max_tokens:
-        return "\n".join(patches_extended)
-    else:
-        return _clip_diff(languages, token_handler, add_line_numbers_to_hunks)
 
+def _split_patch(file, patch, token_handler, budget, add_line_numbers_to_hunks, notes=()):
+    """
+    将超出预算的单个文件补丁按hunk拆分为多段，每段都不超过预算（单个hunk超出预算时截断）
 
-def _filter_ignored(files):
+    Args:
+        file (FilePatchInfo):
+        patch (str): 扩展后的补丁
+        token_handler (TokenHandler):
+        budget (int): 每段的tokens上限
+        add_line_numbers_to_hunks (bool):
+        notes (Iterable[str]): 压缩补丁时产生的说明
+
+    Returns:
+        list[tuple[str, int]]: (补丁字符串, tokens)列表
+    """
+    hunks = [hunk.lines if not hunk.header else [hunk.header, *hunk.lines] for hunk in _parse_hunks(file, patch)]
+
+    def _piece(lines):
+        piece = _format_patch(file, "\n".join(lines), add_line_numbers_to_hunks, notes)
+        if (tokens := token_handler.count_tokens(piece)) > budget:
+            return clip_tokens(token_handler, piece, budget), budget
+        return piece, tokens
+
+    pieces = []
+    current = []
+    for hunk in hunks:
+        candidate = _format_patch(file, "\n".join(current + hunk), add_line_numbers_to_hunks, notes)
+        if current and token_handler.count_tokens(candidate) > budget:
+            pieces.append(_piece(current))
+            current = []
+        current.extend(hunk)
+    if current:
+        pieces.append(_piece(current))
+    return pieces
+
+
+def _parse_hunks(file, patch):
     """
-    过滤掉特定的文件（过滤规则配置在configuration.toml的ignore配置）
+    将补丁拆分为hunk
+
+    Args:
+        file (FilePatchInfo):
+        patch (str):
+
+    Returns:
+        list[HunkInfo]
+    """
+    hunks = []
+    for line in patch.splitlines():
+        if line.startswith("@@"):
+            hunks.append(HunkInfo(file, line, [], len(hunks)))
+        elif hunks:
+            hunks[-1].lines.append(line)
+        elif line:
+            hunks.append(HunkInfo(file, "", [line], 0))
+    return hunks
+
+
+def _filter_ignored(files, project=None):
+    """
+    过滤掉特定的文件（过滤规则配置在configuration.toml的ignore配置以及项目级的忽略规则文件中）
 
     Args:
         files (list[FilePatchInfo])
+        project (str | None): 项目路径
 
     Returns:
         list[FilePatchInfo]
     """
-
     try:
-        # load regex patterns, and translate glob patterns to regex
-        patterns = CONFIG.ignore.regex
-        patterns += [fnmatch.translate(glob) for glob in CONFIG.ignore.glob]
-
-        # compile all valid patterns
-        compiled_patterns = []
-        for r in patterns:
-            try:
-                compiled_patterns.append(re.compile(r))
-            except re.error:
-                pass
-
-        # 保留不匹配忽略正则表达式的文件
-        for r in compiled_patterns:
-            files = [f for f in files if (f.filename and not r.match(f.filename))]
-
+        matcher = get_ignore_matcher(project)
     except Exception as e:
         logger.error(f"Could not filter file list: {e}")
+        return files
 
-    return files
+    # 保留不匹配忽略规则的文件
+    return [f for f in files if f.filename and not matcher.match(f.filename)]
 
 
 def _sort_files_by_main_languages(languages, files):
     """
-    按主要语言对文件进行排序，将使用主要语言的文件放在前面，其余文件放在后面
+    按主要语言对文件进行排序，将使用主要语言的文件放在前面，其余文件放在后面（通过扩展名的反向索引一次遍历完成分组）
 
     Args:
         languages (dict):
@@ -109,34 +290,30 @@ def _sort_files_by_main_languages(languages, files):
     Returns:
         list[LanguageInfo]:
     """
-    # 按语言的大小排序
-    sorted_languages = [k for k, v in sorted(languages.items(), key=lambda item: item[1], reverse=True)]
-    # 获取语言的所有扩展名
-    main_extensions = [LANGUAGE_EXTENSION_MAP.get(language.lower(), set()) for language in sorted_languages]
     # 过滤掉不良扩展名的文件
     filtered_files = [f for f in files if f.filename and is_valid_file(f.filename)]
 
-    files_sorted = []
-    rest_files = {}
-
     # 如果没有检测到语言，将所有文件放在“其他”类别中
     if not languages:
-        return [({"language": "Other", "files": filtered_files})]
+        return [LanguageInfo("Other", filtered_files)]
 
-    main_extensions_flat = {x for ext in main_extensions for x in ext}
+    # 按语言的大小排序
+    sorted_languages = [k for k, v in sorted(languages.items(), key=lambda item: item[1], reverse=True)]
+    ranks = {}
+    for rank, language in enumerate(sorted_languages):
+        ranks.setdefault(language.lower(), rank)
+
+    groups = [[] for _ in sorted_languages]
+    rest_files = []
+    for file in filtered_files:
+        language = get_file_language(file.filename)
+        if language is not None and (rank := ranks.get(language.lower())) is not None:
+            groups[rank].append(file)
+        else:
+            rest_files.append(file)
 
-    for extensions, lang in zip(main_extensions, sorted_languages):  # noqa: B905
-        tmp = []
-        for file in filtered_files:
-            extension_str = f".{file.filename.split('.')[-1]}"
-            if extension_str in extensions:
-                tmp.append(file)
-            else:
-                if (file.filename not in rest_files) and (extension_str not in main_extensions_flat):
-                    rest_files[file.filename] = file
-        if tmp:
-            files_sorted.append(LanguageInfo(lang, tmp))
-    files_sorted.append(LanguageInfo("Other", list(rest_files.values())))
+    files_sorted = [LanguageInfo(lang, group) for lang, group in zip(sorted_languages, groups) if group]  # noqa: B905
+    files_sorted.append(LanguageInfo("Other", rest_files))
     return files_sorted
 
 
@@ -287,100 +464,262 @@ def _extend_patch(original_file_str, patch_str, num_lines):
     return "\n".join(extended_patch_lines)
 
 
-def _clip_diff(languages, token_handler, add_line_numbers_to_hunks):
+def _clip_diff(languages, compacted, token_handler, add_line_numbers_to_hunks, max_batches=1):
     """
-    修剪差异字符串以满足tokens限制
+    修剪差异字符串以满足tokens限制：以hunk为单位评估审查价值，按价值密度(价值/tokens)做背包式的选择，
+    在预算内尽可能多地保留有价值的修改行并按价值从高到低输出，最后列出被省略的文件以及部分被省略的文件。
+    分批审查超出批次上限时同样按价值密度把hunk装入各批次（每一批都是一个背包）
 
     Args:
         languages (list[LanguageInfo]):
+        compacted (dict[str, tuple[str, list[str]]]): 文件名: (压缩后的补丁, 说明)
         token_handler (TokenHandler):
         add_line_numbers_to_hunks (bool):
+        max_batches (int): 最多的批次数量
 
     Returns:
-        str: 修剪后的diff字符串
+        list[str]: 每一批修剪后的diff字符串
 
     Minimization techniques to reduce the number of tokens:
-    0. Start from the largest diff patch to smaller ones
     1. Don't use extend context lines around diff
     2. Minimize deleted files
     3. Minimize deleted hunks
-    4. Minimize all remaining files when you reach token limit
+    4. Select the hunks with the highest value per token until the budget is used up
+    5. Minimize all remaining files
     """
+    deleted_files_list = []
+    file_hunks = {}  # 文件名: (文件, 所有hunk)
+    for rank, lang in enumerate(languages):
+        for file in lang.files:
+            if not file.patch:
+                continue
+            patch = _handle_patch_deletions(file, compacted[file.filename][0])
+            if patch is None:
+                # 整个文件都是删除的就只记录名字
+                deleted_files_list.append(file.filename)
+                continue
+            if hunks := _parse_hunks(file, patch):
+                _score_hunks(file, hunks, lang.name, rank)
+                file_hunks[file.filename] = (file, hunks)
+
+    # 计算每个hunk以及文件头的tokens
+    files = [file for file, _ in file_hunks.values()]
+    hunks = [hunk for _, file_hunk_list in file_hunks.values() for hunk in file_hunk_list]
+    header_tokens = dict(
+        zip(
+            (file.filename for file in files),
+            token_handler.count_tokens_batch(
+                [_format_patch(file, "", add_line_numbers_to_hunks, compacted[file.filename][1]) for file in files]
+            ),
+        )
+    )
+    hunk_tokens = token_handler.count_tokens_batch(
+        [
+            _format_patch(hunk.file, str(hunk), add_line_numbers_to_hunks, compacted[hunk.file.filename][1])
+            for hunk in hunks
+        ]
+    )
+    for hunk, tokens in zip(hunks, hunk_tokens):
+        hunk.tokens = max(1, tokens - header_tokens[hunk.file.filename])
+
+    # 预留省略文件列表所需的tokens（最多占预算的十分之一），文件列表放在最后一批
+    budget = token_handler.max_tokens - token_handler.prompt_tokens - TOKENS_SOFT_BUFFER_THRESHOLD
+    names_tokens = sum(token_handler.count_tokens_batch([f"{name}\n" for name in file_hunks]))
+    reserved = min(budget // 10, names_tokens + token_handler.count_tokens(ADDED_FILES_ + MODIFIED_FILES_))
+    deleted_str = DELETED_FILES_ + "\n".join(deleted_files_list) if deleted_files_list else ""
+    deleted_tokens = token_handler.count_tokens(deleted_str) if deleted_str else 0
+    capacities = [budget] * max_batches
+    capacities[-1] -= reserved + deleted_tokens
+
+    # 按价值密度从高到低选择，依次尝试各批次（优先放入已经包含该文件的批次），文件头的tokens在文件第一次放入该批次时计入
+    batches = [{} for _ in range(max_batches)]  # 文件名: 选中的hunk的id
+    used = [0] * max_batches
+    selected = set()
+    for hunk in sorted(hunks, key=lambda h: h.score / h.tokens, reverse=True):
+        if hunk.score <= 0:
+            break
+        filename = hunk.file.filename
+        for index in sorted(range(max_batches), key=lambda i: filename not in batches[i]):
+            cost = hunk.tokens + (0 if filename in batches[index] else header_tokens[filename])
+            if used[index] + cost <= capacities[index]:
+                used[index] += cost
+                batches[index].setdefault(filename, set()).add(id(hunk))
+                selected.add(id(hunk))
+                break
 
-    patches = []
     added_files_list = []
     modified_files_list = []
-    deleted_files_list = []
-    # sort each one of the languages in top_langs by the number of tokens in the diff
-    sorted_files = []
-    for lang in languages:
-        sorted_files.extend(sorted(lang.files, key=lambda x: x.tokens, reverse=True))
-
-    total_tokens = token_handler.prompt_tokens
-    for file in sorted_files:
-        if not file.patch:
-            continue
+    partial_files_list = []
+    reviewed_lines = omitted_lines = 0
+    for file, file_hunk_list in file_hunks.values():
+        kept = [hunk for hunk in file_hunk_list if id(hunk) in selected]
+        reviewed_lines += sum(hunk.added + hunk.deleted for hunk in kept)
+        omitted_lines += sum(hunk.added + hunk.deleted for hunk in file_hunk_list if id(hunk) not in selected)
+        if not kept:
+            logger.debug(f"Patch too large, minimizing it, {file.filename}")
+            (added_files_list if file.edit_type == EditType.ADDED else modified_files_list).append(file.filename)
+        elif len(kept) < len(file_hunk_list):
+            partial_files_list.append(f"{file.filename}（省略了{len(file_hunk_list) - len(kept)}个代码块）")
+    logger.info(
+        f"Diff clipped: {reviewed_lines} changed lines kept, {omitted_lines} omitted, "
+        f"{len(added_files_list) + len(modified_files_list)} files omitted, {len(partial_files_list)} partially"
+    )
+
+    diffs = []
+    for batch in batches:
+        # 价值越高的文件越靠前输出，文件内的hunk保持原有顺序
+        patches = []
+        for filename, ids in sorted(
+            batch.items(),
+            key=lambda item: sum(hunk.score for hunk in file_hunks[item[0]][1] if id(hunk) in item[1]),
+            reverse=True,
+        ):
+            file, file_hunk_list = file_hunks[filename]
+            kept = "\n".join(str(hunk) for hunk in file_hunk_list if id(hunk) in ids)
+            patches.append(_format_patch(file, kept, add_line_numbers_to_hunks, compacted[filename][1]).strip("\n"))
+        if patches:
+            diffs.append("\n\n".join(patches))
+    if not diffs:
+        diffs.append("")
+
+    # 装入了hunk的批次总是排在前面，最后一批没有装入任何hunk时文件列表放在实际的最后一批中，只使用该批剩余的tokens
+    room = budget - used[len(diffs) - 1] - deleted_tokens
+    if omitted := _format_omitted(added_files_list, modified_files_list, partial_files_list):
+        diffs[-1] += "\n\n" + clip_tokens(token_handler, omitted, max(room, 0))
+    if deleted_str:
+        diffs[-1] += "\n\n" + deleted_str
+    return diffs
+
+
+def _format_omitted(added_files_list, modified_files_list, partial_files_list):
+    """
+    生成被省略的文件列表
 
-        patch = _handle_patch_deletions(file)
-        if patch is None:
-            # 整个文件都是删除的就只记录名字
-            if not deleted_files_list:
-                total_tokens += token_handler.count_tokens(DELETED_FILES_)
-            deleted_files_list.append(file.filename)
-            total_tokens += token_handler.count_tokens(file.filename) + 1
-            continue
+    Args:
+        added_files_list (list[str]): 整个被省略的新增文件
+        modified_files_list (list[str]): 整个被省略的修改文件
+        partial_files_list (list[str]): 部分修改被省略的文件
 
-        if add_line_numbers_to_hunks:
-            patch = _convert_to_hunks_with_lines_numbers(patch, file)
+    Returns:
+        str: 没有省略的文件时为空字符串
+    """
+    omitted = []
+    if added_files_list:
+        omitted.append(ADDED_FILES_ + "\n".join(added_files_list))
+    if modified_files_list:
+        omitted.append(MODIFIED_FILES_ + "\n".join(modified_files_list))
+    if partial_files_list:
+        omitted.append(PARTIAL_FILES_ + "\n".join(partial_files_list))
+    return "\n\n".join(omitted)
 
-        # tokens不足，硬终止
-        if total_tokens > token_handler.max_tokens - TOKENS_HARD_BUFFER_THRESHOLD:
-            logger.warning(f"tokens不足，文件被忽略: {file.filename}")
-            continue
 
-        # 如果补丁太大，只显示文件名
-        if total_tokens + token_handler.count_tokens(patch) > token_handler.max_tokens - TOKENS_SOFT_BUFFER_THRESHOLD:
-            # Current logic is to skip the patch if it's too large
-            logger.debug(f"Patch too large, minimizing it, {file.filename}")
-            if file.edit_type == EditType.ADDED:
-                if not added_files_list:
-                    total_tokens += token_handler.count_tokens(ADDED_FILES_)
-                added_files_list.append(file.filename)
-            else:
-                if not modified_files_list:
-                    total_tokens += token_handler.count_tokens(MODIFIED_FILES_)
-                modified_files_list.append(file.filename)
-                total_tokens += token_handler.count_tokens(file.filename) + 1
-            continue
+def _format_skipped(git, token_handler):
+    """
+    生成获取差异时跳过的文件列表（占用tokens缓冲的一部分）
 
-        if patch:
-            if not add_line_numbers_to_hunks:
-                patch_final = f"## {file.filename}\n\n{patch}\n"
-            else:
-                patch_final = patch
-            patches.append(patch_final)
-            total_tokens += token_handler.count_tokens(patch_final)
-            logger.debug(f"Tokens: {total_tokens}, last filename: {file.filename}")
+    Args:
+        git (GitProvider):
+        token_handler (TokenHandler):
 
-    final_diff = "\n".join(patches)
-    if added_files_list:
-        added_list_str = ADDED_FILES_ + "\n".join(added_files_list)
-        final_diff = final_diff + "\n\n" + added_list_str
-    if modified_files_list:
-        modified_list_str = MODIFIED_FILES_ + "\n".join(modified_files_list)
-        final_diff = final_diff + "\n\n" + modified_list_str
-    if deleted_files_list:
-        deleted_list_str = DELETED_FILES_ + "\n".join(deleted_files_list)
-        final_diff = final_diff + "\n\n" + deleted_list_str
-    return final_diff
+    Returns:
+        str: 没有跳过的文件时为空字符串
+    """
+    if not git.skipped_files:
+        return ""
+    skipped = SKIPPED_FILES_ + "\n".join(f"{filename}（{reason}）" for filename, reason in git.skipped_files)
+    return "\n\n" + clip_tokens(token_handler, skipped, TOKENS_SOFT_BUFFER_THRESHOLD // 2)
+
+
+def _score_hunks(file, hunks, language, rank):
+    """
+    评估文件中每个hunk的审查价值（写入hunk.score）
+
+    Args:
+        file (FilePatchInfo):
+        hunks (list[HunkInfo]):
+        language (str): 文件所属的语言分组
+        rank (int): 语言分组的排名
+
+    Returns:
+        float: 文件所有hunk的价值之和
+    """
+    churn = _relative_churn(file, hunks)
+    for hunk in hunks:
+        hunk.score = _score_hunk(hunk, language, rank, churn)
+    return sum(hunk.score for hunk in hunks)
+
+
+def _relative_churn(file, hunks):
+    """
+    估计文件的相对改动量：修改的行数/文件的行数，改动占比越大的文件越容易引入缺陷。
+    只使用已经加载的文件内容计算行数（不为此额外下载文件），没有加载时不使用该信号；新增的文件没有原有代码，相对改动量为0
+
+    Args:
+        file (FilePatchInfo):
+        hunks (list[HunkInfo]):
+
+    Returns:
+        float: 0~1
+    """
+    if file.edit_type == EditType.ADDED:
+        return 0.0
+    attr = next((attr for attr in ("base_file", "head_file") if file.is_loaded(attr)), None)
+    content = getattr(file, attr) if attr else None
+    length = len(content.splitlines()) if content else 0
+    changed = sum(hunk.added + hunk.deleted for hunk in hunks)
+    return min(1.0, changed / length) if length else 0.0
+
+
+def _score_hunk(hunk, language, rank, churn=0.0):
+    """
+    根据本地可得的信号评估hunk的审查价值：修改的行数(新增的行比删除的行更需要审查)、新增行的占比、主要语言、
+    是否为测试/生成的文件、文件的相对改动量、是否修改了函数签名
+
+    Args:
+        hunk (HunkInfo):
+        language (str): 文件所属的语言分组
+        rank (int): 语言分组的排名
+        churn (float): 文件的相对改动量
+
+    Returns:
+        float
+    """
+    added, deleted = hunk.added, hunk.deleted
+    if not added and not deleted:
+        return 0.0
+    score = (added + 0.25 * deleted) * (0.5 + 0.5 * added / (added + deleted))
+    score *= 0.3 if language == "Other" else 1 / (1 + 0.2 * rank)
+    score *= _file_type_priority(hunk.file.filename)
+    score *= 1 + 0.5 * churn
+    if any(line[:1] in "+-" and SIGNATURE_PATTERN.match(line[1:]) for line in hunk.lines):
+        score *= 1.5
+    return score
+
+
+def _file_type_priority(filename):
+    """
+    文件类型的优先级系数：业务代码优先，测试文件次之，生成的文件最后（依赖锁文件在获取差异时已经跳过）
+
+    Args:
+        filename (str):
+
+    Returns:
+        float
+    """
+    if GENERATED_FILE_PATTERN.search(filename):
+        return 0.1
+    if TEST_FILE_PATTERN.search(filename):
+        return 0.6
+    return 1.0
 
 
-def _handle_patch_deletions(file):
+def _handle_patch_deletions(file, patch=None):
     """
     返回移除了删除块的补丁字符串
 
     Args:
         file (FilePatchInfo): 文件实例
+        patch (str | None): 压缩后的补丁，默认使用文件原始的补丁
 
     Returns:
         str: 忽略掉删除块后的补丁字符串。
@@ -422,12 +761,13 @@ def _handle_patch_deletions(file):
 
         return "\n".join(added_patched)
 
-    if not file.head_file and file.edit_type == EditType.DELETED:
+    if file.edit_type == EditType.DELETED and not file.head_file:
         # logic for handling deleted files - don't show patch, just show that the file was deleted
         logger.info(f"Processing file: {file.filename}, minimizing deletion file")
         return None
     else:
-        patch_new = _omit_deletion_hunks(file.patch.splitlines())
-        if file.patch != patch_new:
+        patch = file.patch if patch is None else patch
+        patch_new = _omit_deletion_hunks(patch.splitlines())
+        if patch != patch_new:
             logger.info(f"Processing file: {file.filename}, hunks were deleted")
         return patch_new
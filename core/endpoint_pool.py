@@ -0,0 +1,222 @@
+import asyncio
+import contextlib
+import random
+import time
+from collections import deque
+
+from config import CONFIG
+from utils import *
+
+
+class Endpoint:
+    """
+    单个推理服务地址的状态：正在执行的请求数、熔断状态以及最近的耗时
+    """
+
+    def __init__(self, url):
+        """
+
+        Args:
+            url (str): OpenAI兼容的chat completions接口地址
+        """
+        self.url = url
+        self.outstanding = 0
+        self.failures = 0  # 连续失败的次数
+        self.opened_at = None  # 熔断开始的时间，None表示未熔断
+        self.probing = False  # 熔断恢复期间是否已经有一个试探请求
+        self.latencies = deque(maxlen=CONFIG.config.ai_latency_window)
+
+    def available(self, now):
+        """
+        是否可以接收请求：未熔断，或者熔断已过恢复时间并且还没有试探请求（半开状态）
+
+        Args:
+            now (float):
+
+        Returns:
+            bool
+        """
+        if self.opened_at is None:
+            return True
+        return not self.probing and now - self.opened_at >= CONFIG.config.ai_breaker_recovery
+
+    def stats(self):
+        # 不包含地址：统计接口没有鉴权，不暴露内部推理服务的地址
+        return {
+            "outstanding": self.outstanding,
+            "failures": self.failures,
+            "open": self.opened_at is not None,
+        }
+
+
+class EndpointPool:
+    """
+    同一个模型的多个推理服务地址：按正在执行的请求数最少的原则分配请求，
+    连续失败的地址会被熔断一段时间，开启对冲时主请求耗时超过历史耗时的指定分位数后向另一个地址发送相同的请求，
+    以先成功返回的为准
+    """
+
+    def __init__(self, urls, is_failure):
+        """
+
+        Args:
+            urls (list[str]): 推理服务地址
+            is_failure (Callable[[Exception], bool]): 判断异常是否属于服务端的故障（计入熔断）
+        """
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.is_failure = is_failure
+
+    def acquire(self, exclude=()):
+        """
+        选择正在执行的请求数最少的可用地址（数量相同时随机选择）
+
+        Args:
+            exclude (Collection[Endpoint]): 不参与选择的地址
+
+        Returns:
+            tuple[Endpoint, bool]: 地址, 是否为熔断恢复期间的试探请求
+        """
+        now = time.monotonic()
+        candidates = [e for e in self.endpoints if e not in exclude and e.available(now)]
+        if not candidates:
+            raise RuntimeError("没有可用的AI接口地址（全部处于熔断状态）")
+        least = min(e.outstanding for e in candidates)
+        endpoint = random.choice([e for e in candidates if e.outstanding == least])
+        if probe := endpoint.opened_at is not None:
+            endpoint.probing = True
+        endpoint.outstanding += 1
+        return endpoint, probe
+
+    def release(self, endpoint, failed=False, latency=None, probe=False):
+        """
+        请求结束，更新地址的熔断状态以及耗时
+
+        Args:
+            endpoint (Endpoint):
+            failed (bool): 是否因为服务端的故障失败
+            latency (float | None): 成功请求的耗时(秒)
+            probe (bool): 是否为试探请求（熔断之前发出的请求结束时不能放行新的试探请求）
+
+        Returns:
+            None
+        """
+        endpoint.outstanding -= 1
+        if probe:
+            endpoint.probing = False
+        if failed:
+            endpoint.failures += 1
+            if endpoint.opened_at is not None or endpoint.failures >= CONFIG.config.ai_breaker_failures:
+                if endpoint.opened_at is None:
+                    logger.warning(f"AI endpoint circuit opened: {endpoint.url}")
+                endpoint.opened_at = time.monotonic()
+            return
+        if latency is not None:
+            endpoint.latencies.append(latency)
+            if endpoint.opened_at is not None:
+                logger.info(f"AI endpoint circuit closed: {endpoint.url}")
+            endpoint.failures = 0
+            endpoint.opened_at = None
+            endpoint.probing = False
+
+    @contextlib.asynccontextmanager
+    async def lease(self, exclude=()):
+        """
+        占用一个地址直到上下文结束（流式调用等无法对冲的场景使用）
+
+        Args:
+            exclude (Collection[Endpoint]): 不参与选择的地址
+
+        Yields:
+            Endpoint
+        """
+        endpoint, probe = self.acquire(exclude)
+        async with self._track(endpoint, probe):
+            yield endpoint
+
+    def hedge_delay(self):
+        """
+        发送对冲请求前等待的时间：所有地址最近成功请求耗时的指定分位数（未开启或者样本不足时为None）
+
+        Returns:
+            float | None
+        """
+        if not (percentile := CONFIG.config.ai_hedge_percentile) or len(self.endpoints) < 2:
+            return None
+        latencies = sorted(latency for e in self.endpoints for latency in e.latencies)
+        if len(latencies) < CONFIG.config.ai_hedge_min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+    @contextlib.asynccontextmanager
+    async def _track(self, endpoint, probe=False):
+        """
+        跟踪已占用地址上的请求：超时计入熔断，被取消（对冲中落后的请求或者外部取消）或者提前关闭的请求不计入熔断也不记录耗时
+
+        Args:
+            endpoint (Endpoint):
+            probe (bool): 是否为试探请求
+
+        Yields:
+            Endpoint
+        """
+        start = time.monotonic()
+        try:
+            yield endpoint
+        except (asyncio.CancelledError, GeneratorExit):
+            self.release(endpoint, probe=probe)
+            raise
+        except Exception as ex:
+            self.release(endpoint, failed=self.is_failure(ex), probe=probe)
+            raise
+        self.release(endpoint, latency=time.monotonic() - start, probe=probe)
+
+    async def _attempt(self, endpoint, probe, func, deadline):
+        async with self._track(endpoint, probe):
+            # 超时在请求内部触发（TimeoutError），而不是从外部取消，才能计入熔断
+            return await asyncio.wait_for(func(endpoint.url), timeout=deadline - asyncio.get_running_loop().time())
+
+    async def call(self, func, timeout):
+        """
+        选择地址执行请求，主请求超过对冲等待时间仍未完成时向另一个地址发送对冲请求，返回先成功的结果
+
+        Args:
+            func (Callable[[str], Awaitable]): 参数为地址的请求函数
+            timeout (float): 整个调用的超时时间(秒)，主请求和对冲请求共用，超时抛出TimeoutError
+
+        Returns:
+            Any
+        """
+        deadline = asyncio.get_running_loop().time() + timeout
+        primary, probe = self.acquire()
+        tasks = {asyncio.create_task(self._attempt(primary, probe, func, deadline))}
+        try:
+            if (delay := self.hedge_delay()) is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    try:
+                        hedge, probe = self.acquire(exclude=(primary,))
+                    except RuntimeError:
+                        hedge = None
+                    if hedge is not None:
+                        logger.info(f"AI request hedged after {delay:.1f}s: {primary.url} -> {hedge.url}")
+                        tasks.add(asyncio.create_task(self._attempt(hedge, probe, func, deadline)))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self):
+        """
+        各地址的状态
+
+        Returns:
+            list[dict]
+        """
+        return [{"endpoint": index, **endpoint.stats()} for index, endpoint in enumerate(self.endpoints)]
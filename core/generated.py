@@ -0,0 +1,107 @@
+import re
+
+from config import CONFIG
+
+# 依赖锁文件
+LOCK_FILES = {
+    "package-lock.json",
+    "npm-shrinkwrap.json",
+    "yarn.lock",
+    "pnpm-lock.yaml",
+    "bun.lockb",
+    "poetry.lock",
+    "Pipfile.lock",
+    "uv.lock",
+    "pdm.lock",
+    "Cargo.lock",
+    "go.sum",
+    "composer.lock",
+    "Gemfile.lock",
+    "mix.lock",
+    "pubspec.lock",
+    "Podfile.lock",
+    "packages.lock.json",
+    "gradle.lockfile",
+    "flake.lock",
+}
+# 按文件名就能识别的生成文件
+GENERATED_FILE_PATTERN = re.compile(
+    r"\.min\.(js|css)$|\.(js|css)\.map$|_pb2(_grpc)?\.pyi?$|\.pb(\.gw)?\.go$|\.pb\.(h|cc)$|(^|/)generated/|\.g\.dart$"
+    r"|\.freezed\.dart$|\.designer\.cs$|_generated\.\w+$|\.generated\.\w+$"
+)
+# 第三方代码所在的目录
+VENDOR_DIR_PATTERN = re.compile(
+    r"(^|/)(node_modules|bower_components|vendor|vendors|third_party|thirdparty|3rdparty|Pods|\.yarn)/"
+)
+# 文件开头注释中已知工具的生成标记：Go的`// Code generated ... DO NOT EDIT.`以及`@generated`
+GENERATED_MARKER_PATTERN = re.compile(r"^\s*(//|#|/?\*+|<!--)\s*(Code generated .+ DO NOT EDIT\b|@generated\b)")
+# 依赖锁文件的内容特征
+LOCKFILE_SIGNATURE_PATTERN = re.compile(
+    r'^\s*(# yarn lockfile v\d|"?lockfileVersion"?\s*:|# This file is autogenerated)'
+)
+# 只检查文件开头的若干行中的标记
+_HEAD_LINES = 10
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,\d+)? \+(\d+)(?:,\d+)? @@")
+
+
+def _sample_lines(patch):
+    """
+    截取补丁开头的一部分，提取其中新版本文件的代码行（新增的行以及上下文）以及属于文件开头的代码行
+
+    Args:
+        patch (str):
+
+    Returns:
+        tuple[list[str], list[str]]: 代码行（不含+/-前缀）, 文件开头的代码行
+    """
+    lines = []
+    head_lines = []
+    position = None  # 当前行在新版本文件中的位置，None表示不在文件开头的hunk中
+    for line in patch[: CONFIG.config.generated_sample_bytes].splitlines():
+        if line.startswith("@@"):
+            match = _HUNK_HEADER.match(line)
+            position = 1 if match and int(match.group(2)) <= 1 else None
+            continue
+        # 删除的行不属于新版本的文件
+        if line.startswith(("\\", "-")):
+            continue
+        lines.append(line[1:])
+        if position is not None and position <= _HEAD_LINES:
+            head_lines.append(line[1:])
+            position += 1
+    return lines, head_lines
+
+
+def detect_generated_file(filename, patch):
+    """
+    根据文件名以及补丁开头的内容识别生成的文件、第三方代码以及依赖锁文件，不需要下载文件内容：
+    文件名/目录特征、文件开头的生成标记、锁文件的内容特征以及压缩代码的行长度统计
+
+    Args:
+        filename (str):
+        patch (str | None): 补丁（GitLab省略了diff的文件为空）
+
+    Returns:
+        str | None: 识别的原因，不是生成的文件时为None
+    """
+    if filename.rsplit("/", 1)[-1] in LOCK_FILES:
+        return "依赖锁文件"
+    if GENERATED_FILE_PATTERN.search(filename):
+        return "生成的文件"
+    if VENDOR_DIR_PATTERN.search(filename):
+        return "第三方代码"
+    if not patch:
+        return None
+
+    lines, head_lines = _sample_lines(patch)
+    if any(LOCKFILE_SIGNATURE_PATTERN.match(line) for line in head_lines):
+        return "依赖锁文件"
+    if any(GENERATED_MARKER_PATTERN.match(line) for line in head_lines):
+        return "生成的文件"
+    # 压缩/打包后的代码以及内嵌的数据：平均行很长并且几乎没有空白字符（排除长段落的文档）
+    if lines := [line for line in lines if line.strip()]:
+        chars = sum(map(len, lines))
+        spaces = sum(line.count(" ") + line.count("\t") for line in lines)
+        if chars / len(lines) > CONFIG.config.generated_avg_line_length and spaces / chars < 0.1:
+            return "压缩后的代码"
+    return None
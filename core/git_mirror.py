@@ -0,0 +1,415 @@
+import base64
+import os
+import re
+import subprocess
+import threading
+from collections import defaultdict
+from urllib.parse import urlparse
+
+from .git_provider import GitProvider
+from defines import *
+from utils import *
+
+# git输出中可能出现的凭据：URL中的用户信息以及认证头
+_CREDENTIALS_PATTERN = re.compile(r"(://)[^/@\s]+@|(Authorization:\s*)\S+(\s+\S+)?", re.IGNORECASE)
+
+
+def _redact(text):
+    """
+    隐藏git输出中的凭据
+
+    Args:
+        text (str):
+
+    Returns:
+        str
+    """
+    return _CREDENTIALS_PATTERN.sub(lambda m: f"{m.group(1)}***@" if m.group(1) else f"{m.group(2)}***", text)
+
+
+def _decode_path(path):
+    """
+    解码git输出中的路径
+
+    Args:
+        path (bytes):
+
+    Returns:
+        str
+    """
+    return path.decode("utf-8", errors="surrogateescape")
+
+
+def _auth_env(token):
+    """
+    通过环境变量中的git配置传递认证头，token不会出现在命令行参数（ps可见）以及远端地址中
+
+    Args:
+        token (str | None): 项目的访问密钥
+
+    Returns:
+        dict[str, str] | None: git进程的环境变量，不需要认证时为None
+    """
+    if not token:
+        return None
+    credentials = base64.b64encode(f"oauth2:{token}".encode()).decode()
+    return {
+        **os.environ,
+        "GIT_CONFIG_COUNT": "1",
+        "GIT_CONFIG_KEY_0": "http.extraHeader",
+        "GIT_CONFIG_VALUE_0": f"Authorization: Basic {credentials}",
+        "GIT_TERMINAL_PROMPT": "0",
+    }
+
+
+class GitMirror:
+    """
+    本地裸仓库镜像：通过增量fetch保持与远端同步，在本地计算diff，
+    并通过常驻的`git cat-file --batch`进程批量读取文件内容
+    """
+
+    def __init__(self, path):
+        """
+
+        Args:
+            path (str): 裸仓库所在的目录
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._batch = None
+
+    def _run(self, *args, env=None):
+        return subprocess.run(["git", f"--git-dir={self.path}", *args], capture_output=True, check=False, env=env)
+
+    def _git(self, *args, env=None):
+        """
+        在镜像仓库中执行git命令
+
+        Args:
+            args (str): git命令以及参数
+            env (dict[str, str] | None): 环境变量
+
+        Returns:
+            bytes: 标准输出
+        """
+        result = self._run(*args, env=env)
+        if result.returncode != 0:
+            raise RuntimeError(f"git {args[0]} failed: {_redact(result.stderr.decode(errors='replace').strip())}")
+        return result.stdout
+
+    def has_commit(self, sha):
+        """
+        判断镜像中是否已经存在指定的commit
+
+        Args:
+            sha (str):
+
+        Returns:
+            bool
+        """
+        if not os.path.exists(self.path):
+            return False
+        return self._run("cat-file", "-e", f"{sha}^{{commit}}").returncode == 0
+
+    def update(self, remote_url, *shas, token=None):
+        """
+        增量同步远端的分支以及MR引用（需要的commit都已存在时不发起fetch）
+        远端地址只在命令行中使用，不会写入镜像的配置中；token通过环境变量传递
+
+        Args:
+            remote_url (str): 远端仓库地址（可以是本地路径），不能包含凭据
+            shas (str): 需要确保存在的commit
+            token (str | None): 项目的访问密钥
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if shas and all(self.has_commit(sha) for sha in shas):
+                return
+            if not os.path.exists(self.path):
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                subprocess.run(["git", "init", "--bare", "--quiet", self.path], check=True, capture_output=True)
+            self._git(
+                "fetch",
+                "--prune",
+                "--quiet",
+                remote_url,
+                "+refs/heads/*:refs/heads/*",
+                "+refs/merge-requests/*:refs/merge-requests/*",
+                env=_auth_env(token),
+            )
+
+    def diff(self, base, head):
+        """
+        计算两个commit之间的差异，返回与GitLab changes接口一致的结构
+
+        Args:
+            base (str):
+            head (str):
+
+        Returns:
+            list[dict]: old_path/new_path/new_file/deleted_file/renamed_file/diff
+        """
+        # --raw -z 用于可靠地获取状态和路径，补丁输出按相同顺序逐个文件切分
+        # 路径不一定是UTF-8编码，用surrogateescape解码，读取文件内容时可以还原出原始的字节
+        raw = self._git("diff", "--raw", "-z", "-M", "--no-abbrev", base, head).split(b"\0")
+        entries = []
+        i = 0
+        while i < len(raw) - 1:
+            status = raw[i].decode().split()[-1]
+            if status[0] in "RC":
+                old_path, new_path = _decode_path(raw[i + 1]), _decode_path(raw[i + 2])
+                i += 3
+            else:
+                old_path = new_path = _decode_path(raw[i + 1])
+                i += 2
+            entries.append((status[0], old_path, new_path))
+
+        patch = self._git("diff", "-M", "--no-color", "--no-ext-diff", base, head).decode("utf-8", errors="replace")
+        sections = [section for section in patch.split("\ndiff --git ") if section]
+        changes = []
+        for (status, old_path, new_path), section in zip(entries, sections):
+            lines = section.split("\n")
+            hunk_start = next((n for n, line in enumerate(lines) if line.startswith("@@")), len(lines))
+            changes.append(
+                {
+                    "old_path": old_path,
+                    "new_path": new_path,
+                    "new_file": status == "A",
+                    "deleted_file": status == "D",
+                    "renamed_file": status == "R",
+                    "diff": "\n".join(lines[hunk_start:]).rstrip("\n") + "\n" if hunk_start < len(lines) else "",
+                }
+            )
+        return changes
+
+    def read_blobs(self, specs):
+        """
+        通过常驻的`git cat-file --batch`进程批量读取文件内容
+
+        Args:
+            specs (list[str]): `<rev>:<path>`列表
+
+        Returns:
+            list[bytes | None]: 与specs顺序一致的文件内容，不存在的为None
+        """
+        # cat-file --batch按行读取请求，包含换行符的路径无法请求
+        requested = [spec for spec in specs if "\n" not in spec]
+        if not requested:
+            return [None] * len(specs)
+        with self._lock:
+            if self._batch is None or self._batch.poll() is not None:
+                self._batch = subprocess.Popen(
+                    ["git", f"--git-dir={self.path}", "cat-file", "--batch"],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                )
+            try:
+                blobs = self._read_batch(requested)
+            except BaseException:
+                # 读写中断后管道中的请求和响应不再对应，必须重新启动进程
+                self._kill_batch()
+                raise
+        result = dict(zip(requested, blobs))
+        return [result.get(spec) for spec in specs]
+
+    def _read_batch(self, specs):
+        # 写入和读取放在不同线程中，避免大量请求时管道缓冲区写满导致死锁
+        request = "".join(f"{spec}\n" for spec in specs).encode(errors="surrogateescape")
+        writer = threading.Thread(target=self._write_batch, args=(self._batch, request))
+        writer.start()
+        try:
+            blobs = []
+            for _ in specs:
+                header = self._batch.stdout.readline()
+                if not header:
+                    raise RuntimeError("git cat-file exited unexpectedly")
+                # `<spec> missing`中的路径可能包含空格，只能根据最后一项判断
+                fields = header.split()
+                if fields[-1] in (b"missing", b"ambiguous"):
+                    blobs.append(None)
+                    continue
+                size = int(fields[2])
+                blobs.append(self._batch.stdout.read(size))
+                self._batch.stdout.read(1)  # 内容后面的换行符
+            return blobs
+        finally:
+            writer.join()
+
+    @staticmethod
+    def _write_batch(process, request):
+        try:
+            process.stdin.write(request)
+            process.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            # 进程已经退出或者被重置，读取的一侧会抛出异常
+            pass
+
+    def _kill_batch(self):
+        if self._batch is not None:
+            self._batch.kill()
+            self._batch.wait()
+            self._batch = None
+
+    def ls_tree(self, ref):
+        """
+        列出指定版本的所有文件以及大小
+
+        Args:
+            ref (str):
+
+        Returns:
+            list[tuple[str, int]]
+        """
+        files = []
+        for line in self._git("ls-tree", "-r", "-l", "-z", ref).split(b"\0"):
+            if not line:
+                continue
+            meta, path = line.split(b"\t", 1)
+            _, obj_type, _, size = meta.split()
+            if obj_type == b"blob":
+                files.append((_decode_path(path), int(size)))
+        return files
+
+    def close(self):
+        """
+        结束常驻的cat-file进程
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if self._batch is not None:
+                self._batch.stdin.close()
+                self._batch.wait()
+                self._batch = None
+
+
+_MIRRORS: dict[str, GitMirror] = {}
+_MIRRORS_LOCK = threading.Lock()
+
+
+def get_mirror(path):
+    """
+    获取进程内共享的镜像实例（同一个镜像只保留一个cat-file进程）
+
+    Args:
+        path (str):
+
+    Returns:
+        GitMirror
+    """
+    with _MIRRORS_LOCK:
+        if path not in _MIRRORS:
+            _MIRRORS[path] = GitMirror(path)
+        return _MIRRORS[path]
+
+
+class MirrorGitProvider(GitProvider):
+    """
+    基于本地裸仓库镜像的GitProvider：MR的元信息以及评论等仍然通过GitLab API完成，
+    diff、文件内容以及语言统计都从本地镜像中获取
+    """
+
+    def __init__(self, git_base, token, mr_url=None):
+        super().__init__(git_base, token, mr_url)
+        parsed = urlparse(git_base)
+        self.mirror = get_mirror(
+            os.path.join(CONFIG.git.mirror_dir, parsed.netloc, parsed.path.strip("/"), f"{self.project_id}.git")
+        )
+        # git_base可能带有路径前缀(例如部署在子路径下的GitLab)
+        self.remote_url = f"{git_base.rstrip('/')}/{self.project_id}.git"
+        self.token = token
+        self.mirror.update(
+            self.remote_url, self.mr.diff_refs["base_sha"], self.mr.diff_refs["head_sha"], token=self.token
+        )
+
+    def _load_changes(self):
+        if self.base_sha != self.mr.diff_refs["base_sha"]:
+            # 增量审查的起点可能不在镜像中
+            self.mirror.update(self.remote_url, self.base_sha, token=self.token)
+        return self.mirror.diff(self.base_sha, self.mr.diff_refs["head_sha"])
+
+    def _get_file_content(self, file_path, ref):
+        blob = self.mirror.read_blobs([f"{ref}:{file_path}"])[0]
+        if blob is None:
+            return ""
+        try:
+            return blob.decode("utf-8")
+        except UnicodeDecodeError:
+            logger.warning(f"{self.mr_id=}: 文件解码失败 {file_path}")
+            return blob
+
+    def load_file_contents(self, files, base=True, head=True):
+        """
+        通过一次cat-file批量请求加载文件内容
+
+        Args:
+            files (list[FilePatchInfo]):
+            base (bool): 是否加载base版本
+            head (bool): 是否加载head版本
+
+        Returns:
+            None
+        """
+        base_sha, head_sha = self.base_sha, self.mr.diff_refs["head_sha"]
+        pending = []
+        for file in files:
+            if base and not file.is_loaded("base_file") and file.edit_type != EditType.ADDED:
+                pending.append((file, "base_file", (base_sha, file.old_filename or file.filename)))
+            if head and not file.is_loaded("head_file") and file.edit_type != EditType.DELETED:
+                pending.append((file, "head_file", (head_sha, file.filename)))
+        # 其他命令已经读取过的文件内容直接复用
+        unread = []
+        for file, attr, (ref, path) in pending:
+            if (content := self.context.peek(f"file:{ref}:{path}")) is not None:
+                setattr(file, attr, content)
+            else:
+                unread.append((file, attr, (ref, path)))
+        blobs = self.mirror.read_blobs([f"{ref}:{path}" for _, _, (ref, path) in unread])
+        for (file, attr, (ref, path)), blob in zip(unread, blobs):
+            if blob is None:
+                content = ""
+            else:
+                try:
+                    content = blob.decode("utf-8")
+                except UnicodeDecodeError:
+                    logger.warning(f"{self.mr_id=}: 文件解码失败 {ref}:{path}")
+                    content = blob
+            setattr(file, attr, self.context.get(f"file:{ref}:{path}", lambda c=content: c))
+
+    def _load_diff_files(self):
+        # 本地计算的diff是完整的，不存在GitLab省略diff的情况
+        return self._build_diff_files(self._get_changes())
+
+    def _load_languages(self):
+        """
+        按文件大小统计head版本中各语言的占比（与GitLab languages接口的格式一致）
+
+        Returns:
+            dict[str, float]
+        """
+        sizes = defaultdict(int)
+        for path, size in self.mirror.ls_tree(self.mr.diff_refs["head_sha"]):
+            if language := get_file_language(path):
+                sizes[language] += size
+        total = sum(sizes.values())
+        return {language: round(size * 100 / total, 2) for language, size in sizes.items()} if total else {}
+
+
+def create_git_provider(git_base, token, mr_url):
+    """
+    根据配置的git.backend创建GitProvider
+
+    Args:
+        git_base (str): gitlab的地址
+        token (str): 项目的访问密钥
+        mr_url (str): merge request的URL
+
+    Returns:
+        GitProvider
+    """
+    if CONFIG.git.backend == "mirror":
+        return MirrorGitProvider(git_base, token, mr_url)
+    return GitProvider(git_base, token, mr_url)
@@ -1,14 +1,26 @@
 import difflib
 import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from typing import Any
 from urllib.parse import urlparse
 
-import gitlab
 from gitlab import GitlabGetError
 
+from .context import get_merge_request_context
+from .generated import detect_generated_file
+from .gitlab_pool import get_gitlab_client
 from defines import *
 from utils import *
 
+# 记录在审查评论中的已审查版本（评论中不可见）
+REVIEWED_MARKER = "<!-- mr-agent:reviewed head={head_sha} base={base_sha} -->"
+_REVIEWED_PATTERN = re.compile(r"<!-- mr-agent:reviewed head=([0-9a-f]+)(?: base=([0-9a-f]+))? -->")
+
+# 所有MR共享的文件内容获取线程池，限制对GitLab的并发请求数量
+_FILE_EXECUTOR = ThreadPoolExecutor(max_workers=CONFIG.config.git_max_workers, thread_name_prefix="git-file")
+
 
 def _load_large_diff(filename, new_file_content, original_file_content):
     """
@@ -122,51 +134,15 @@ def get_main_language(languages, files):
         top_language = max(languages, key=languages.get).lower()
 
         # validate that the specific commit uses the main language
-        extension_list = []
+        # 通过扩展名的反向索引一次遍历统计各语言的文件数，无法识别语言的文件按扩展名分别统计
+        counter = Counter()
         for file in files:
             if not file:
                 continue
-            if isinstance(file, str):
-                file = FilePatchInfo(base_file=None, head_file=None, patch=None, filename=file)
-            extension_list.append(file.filename.rsplit(".")[-1])
-
-        # get the most common extension
-        most_common_extension = max(set(extension_list), key=extension_list.count)
-
-        # look for a match. TBD: add more languages, do this systematically
-        if (
-            most_common_extension == "py"
-            and top_language == "python"
-            or most_common_extension == "js"
-            and top_language == "javascript"
-            or most_common_extension == "ts"
-            and top_language == "typescript"
-            or most_common_extension == "go"
-            and top_language == "go"
-            or most_common_extension == "java"
-            and top_language == "java"
-            or most_common_extension == "c"
-            and top_language == "c"
-            or most_common_extension == "cpp"
-            and top_language == "c++"
-            or most_common_extension == "cs"
-            and top_language == "c#"
-            or most_common_extension == "swift"
-            and top_language == "swift"
-            or most_common_extension == "php"
-            and top_language == "php"
-            or most_common_extension == "rb"
-            and top_language == "ruby"
-            or most_common_extension == "rs"
-            and top_language == "rust"
-            or most_common_extension == "scala"
-            and top_language == "scala"
-            or most_common_extension == "kt"
-            and top_language == "kotlin"
-            or most_common_extension == "pl"
-            and top_language == "perl"
-            or most_common_extension == top_language
-        ):
+            filename = file if isinstance(file, str) else file.filename
+            language = get_file_language(filename)
+            counter[language.lower() if language else f".{filename.rsplit('.')[-1]}"] += 1
+        if counter and counter.most_common(1)[0][0] == top_language:
             main_language = top_language
 
     except Exception as e:
@@ -178,12 +154,16 @@ def get_main_language(languages, files):
 class GitProvider:
 
     def __init__(self, git_base, token, mr_url=None):
-        self.git = gitlab.Gitlab(url=git_base, oauth_token=token)
+        self.git = get_gitlab_client(git_base, token)
         self.project_id = None
+        self.project = None
         self.mr_id = mr_url
         self.mr = None
+        self.base_sha = None
+        self.context = None
         self.diff_files = None
         self.git_files = None
+        self.skipped_files = []  # 获取差异时跳过的(文件名, 原因)
         self.temp_comments = []
         self._set_merge_request(mr_url)
 
@@ -198,9 +178,14 @@ class GitProvider:
 
         """
         self.project_id, mr_id = self._parse_merge_request_url(mr_url)
-        self.mr = self.git.projects.get(self.project_id).mergerequests.get(mr_id)
+        # lazy=True不会发起请求，仅作为后续所有项目级API调用复用的句柄
+        self.project = self.git.projects.get(self.project_id, lazy=True)
+        self.mr = self.project.mergerequests.get(mr_id)
+        self.base_sha = self.mr.diff_refs["base_sha"]
+        # 同一个MR的同一个版本在多个命令之间共享changes、languages、commits等API结果
+        self.context = get_merge_request_context(self.git.url, self.project_id, mr_id, self.mr.diff_refs["head_sha"])
         try:
-            self.last_diff = self.mr.diffs.list(get_all=True)[-1]
+            self.last_diff = self.context.get("diffs", lambda: self.mr.diffs.list(get_all=True))[-1]
         except IndexError as e:
             raise Exception(f"Could not get diff for {self.mr_id}") from e
 
@@ -237,79 +222,211 @@ class GitProvider:
         # otherwise, extract the original user description from the existing mr-agent description and return it
         return description.split(f"## {CONSTANTS.USER_DESCRIPTION}:", 1)[1].strip()
 
-    def _get_file_content(self, file_path, branch):
+    def _get_file_content(self, file_path, ref):
         """
         Get file content from GitLab
 
         Args:
             file_path (str):
-            branch (str):
+            ref (str): 分支或者commit sha
 
         Returns:
             str: file content
         """
         try:
-            return self.git.projects.get(self.project_id).files.get(file_path, branch).decode()
+            content = self.project.files.get(file_path, ref).decode()
         except GitlabGetError:
             # In case of file creation the method returns GitlabGetError (404 file not found).
             # In this case we return an empty string for the diff.
             return ""
+        try:
+            if isinstance(content, bytes):
+                content = bytes.decode(content, "utf-8")
+        except UnicodeDecodeError:
+            logger.warning(f"{self.mr_id=}: 文件解码失败 {file_path}")
+        return content
 
-    def get_diff_files(self):
+    def _get_shared_file_content(self, file_path, ref):
         """
-        检索在MR中被修改、添加、删除或重命名的文件列表，以及它们的内容和补丁信息。
+        获取文件内容：同一个MR的多个命令之间只共享不可变的文件内容，FilePatchInfo由每个命令各自创建
+
+        Args:
+            file_path (str):
+            ref (str): 分支或者commit sha
 
         Returns:
-            list[FilePatchInfo]: MR中修改、添加、删除或重命名的文件列表。
+            str | bytes
+        """
+        return self.context.get(f"file:{ref}:{file_path}", lambda: self._get_file_content(file_path, ref))
+
+    def _content_loader(self, file_path, ref):
+        """
+        生成文件内容的延迟加载函数（FilePatchInfo第一次访问文件内容时才会请求GitLab）
+
+        Args:
+            file_path (str | None): 文件路径，为None时表示该版本的文件不存在
+            ref (str): 分支或者commit sha
+
+        Returns:
+            Callable[[], str] | str
+        """
+        return partial(self._get_shared_file_content, file_path, ref) if file_path else ""
+
+    def load_file_contents(self, files, base=True, head=True):
+        """
+        使用共享线程池并发加载文件内容（已经加载过的直接复用）
+
+        Args:
+            files (list[FilePatchInfo]):
+            base (bool): 是否加载base版本
+            head (bool): 是否加载head版本
+
+        Returns:
+            None
+        """
+        attrs = [attr for attr, need in (("base_file", base), ("head_file", head)) if need]
+        list(_FILE_EXECUTOR.map(lambda item: getattr(*item), [(file, attr) for file in files for attr in attrs]))
+
+    def _build_diff_files(self, changes):
+        """
+        将changes接口格式的差异信息转换为FilePatchInfo（文件内容在首次访问时才加载）
+
+        Args:
+            changes (list[dict]): old_path/new_path/new_file/deleted_file/renamed_file/diff
+
+        Returns:
+            list[FilePatchInfo]
+        """
+        base_sha, head_sha = self.base_sha, self.mr.diff_refs["head_sha"]
+        diff_files = []
+        self.skipped_files = []
+        for diff in changes:
+            if not is_valid_file(diff["new_path"]):
+                continue
+            # 生成的文件、第三方代码以及依赖锁文件在下载文件内容之前就跳过，跳过的文件会列在差异以及审查结果中
+            if CONFIG.config.skip_generated_files and (reason := detect_generated_file(diff["new_path"], diff["diff"])):
+                logger.info(f"{self.mr_id=}: 跳过{reason} {diff['new_path']}")
+                self.skipped_files.append((diff["new_path"], reason))
+                continue
+            if diff["new_file"]:
+                edit_type = EditType.ADDED
+            elif diff["deleted_file"]:
+                edit_type = EditType.DELETED
+            elif diff["renamed_file"]:
+                edit_type = EditType.RENAMED
+            else:
+                edit_type = EditType.MODIFIED
+
+            # 新增文件没有base版本，删除文件没有head版本，这些都不需要请求
+            diff_files.append(
+                FilePatchInfo(
+                    self._content_loader(None if diff["new_file"] else diff["old_path"], base_sha),
+                    self._content_loader(None if diff["deleted_file"] else diff["new_path"], head_sha),
+                    patch=diff["diff"],
+                    filename=diff["new_path"],
+                    edit_type=edit_type,
+                    old_filename=None if diff["old_path"] == diff["new_path"] else diff["old_path"],
+                )
+            )
+        return diff_files
+
+    def _load_changes(self):
         """
+        加载MR的差异信息
 
-        if self.diff_files:
-            return self.diff_files
-
-        self.diff_files = []
-        for diff in self.mr.changes()["changes"]:
-            if is_valid_file(diff["new_path"]):
-                # original_file_content = self._get_pr_file_content(diff['old_path'], self.mr.target_branch)
-                # new_file_content = self._get_pr_file_content(diff['new_path'], self.mr.source_branch)
-                original_file_content = self._get_file_content(diff["old_path"], self.mr.diff_refs["base_sha"])
-                new_file_content = self._get_file_content(diff["new_path"], self.mr.diff_refs["head_sha"])
-
-                try:
-                    if isinstance(original_file_content, bytes):
-                        original_file_content = bytes.decode(original_file_content, "utf-8")
-                    if isinstance(new_file_content, bytes):
-                        new_file_content = bytes.decode(new_file_content, "utf-8")
-                except UnicodeDecodeError:
-                    logger.warning(f"{self.mr_id=}: 文件解码失败 {diff['old_path']} or {diff['new_path']}")
-
-                if diff["new_file"]:
-                    edit_type = EditType.ADDED
-                elif diff["deleted_file"]:
-                    edit_type = EditType.DELETED
-                elif diff["renamed_file"]:
-                    edit_type = EditType.RENAMED
-                else:
-                    edit_type = EditType.MODIFIED
-
-                filename = diff["new_path"]
-
-                self.diff_files.append(
-                    FilePatchInfo(
-                        original_file_content,
-                        new_file_content,
-                        patch=diff["diff"] or _load_large_diff(filename, new_file_content, original_file_content),
-                        filename=filename,
-                        edit_type=edit_type,
-                        old_filename=None if diff["old_path"] == diff["new_path"] else diff["old_path"],
-                    )
+        Returns:
+            list[dict]: old_path/new_path/new_file/deleted_file/renamed_file/diff
+        """
+        if self.base_sha == self.mr.diff_refs["base_sha"]:
+            return self.mr.changes()["changes"]
+        # 增量审查：两个版本之间的直接差异
+        return self.project.repository_compare(self.base_sha, self.mr.diff_refs["head_sha"], straight=True)["diffs"]
+
+    def _get_changes(self):
+        return self.context.get(f"changes:{self.base_sha}", self._load_changes)
+
+    def _load_diff_files(self):
+        """
+        加载MR的差异文件，GitLab省略了diff的文件(过大)需要完整内容来生成补丁
+
+        Returns:
+            list[FilePatchInfo]
+        """
+        diff_files = self._build_diff_files(self._get_changes())
+        if large_files := [file for file in diff_files if not file.patch]:
+            self.load_file_contents(large_files)
+            for file in large_files:
+                file.patch = self.context.get(
+                    f"large_patch:{self.base_sha}:{file.filename}",
+                    lambda f=file: _load_large_diff(f.filename, f.head_file, f.base_file),
                 )
+        return diff_files
+
+    def get_diff_files(self):
+        """
+        检索在MR中被修改、添加、删除或重命名的文件列表，以及它们的补丁信息（文件内容在首次访问时才加载）。
+
+        Returns:
+            list[FilePatchInfo]: MR中修改、添加、删除或重命名的文件列表。
+        """
+        # FilePatchInfo是可变的（tokens等字段由各命令写入），不在命令之间共享
+        if self.diff_files is None:
+            self.diff_files = self._load_diff_files()
         return self.diff_files
 
+    def set_diff_base(self, base_sha):
+        """
+        将差异的起点切换为指定的commit（增量审查时使用上次审查的head）
+
+        Args:
+            base_sha (str):
+
+        Returns:
+            bool: 是否切换成功，指定的commit不可达（例如强制推送之后）时保持完整审查
+        """
+        self.base_sha = base_sha
+        self.diff_files = None
+        self.git_files = None
+        try:
+            self._get_changes()
+        except Exception as e:
+            logger.warning(f"Diff base {base_sha[:8]} is unreachable, fall back to full review: {e!r}")
+            self.base_sha = self.mr.diff_refs["base_sha"]
+            return False
+        return True
+
+    def get_last_reviewed_version(self, headers):
+        """
+        从指定标题的审查评论中获取上次审查的版本
+
+        Args:
+            headers (tuple[str, ...]): 审查评论的标题
+
+        Returns:
+            tuple[str, str | None] | None: 上次审查的(head sha, base sha)，旧版本的评论没有记录base sha
+        """
+        try:
+            # 最新的评论在前
+            for comment in self.mr.notes.list(get_all=True, order_by="created_at", sort="desc"):
+                if comment.body.startswith(headers) and (match := _REVIEWED_PATTERN.search(comment.body)):
+                    return match.group(1), match.group(2)
+        except Exception as e:
+            logger.exception(f"Failed to get last reviewed version: {e=}")
+
     def get_files(self):
         if not self.git_files:
-            self.git_files = [change["new_path"] for change in self.mr.changes()["changes"]]
+            self.git_files = [change["new_path"] for change in self._get_changes()]
         return self.git_files
 
+    def _get_commits(self):
+        """
+        获取MR的所有提交(最新的在前)
+
+        Returns:
+            list[dict]
+        """
+        return self.context.get("commits", lambda: [commit.attributes for commit in self.mr.commits(get_all=True)])
+
     def publish_description(self, title, body):
         """
         Updates the description of the merge request in GitLab
@@ -329,14 +446,15 @@ class GitProvider:
             logger.exception(f"Could not update merge request {self.mr_id} description: {e}")
 
     def get_latest_commit_url(self):
-        return self.mr.commits().next().web_url
+        return self._get_commits()[0]["web_url"]
 
     def get_comment_url(self, comment):
         return f"{self.mr.web_url}#note_{comment.id}"
 
     def publish_persistent_comment(self, mr_comment: str, initial_header: str, update_header: bool = True):
         try:
-            for comment in self.mr.notes.list(get_all=True)[::-1]:
+            # 最新的评论在前
+            for comment in self.mr.notes.list(get_all=True, order_by="created_at", sort="desc"):
                 if comment.body.startswith(initial_header):
                     latest_commit_url = self.get_latest_commit_url()
                     comment_url = self.get_comment_url(comment)
@@ -359,6 +477,25 @@ class GitProvider:
         if is_temporary:
             self.temp_comments.append(comment)
 
+    def update_temporary_comment(self, mr_comment: str):
+        """
+        原地更新最近一条临时评论的内容（用于展示命令执行进度）
+
+        Args:
+            mr_comment (str):
+
+        Returns:
+            None
+        """
+        if not self.temp_comments:
+            return
+        try:
+            comment = self.temp_comments[-1]
+            comment.body = mr_comment
+            comment.save()
+        except Exception as e:
+            logger.exception(f"Failed to update temporary comment: {e=}")
+
     def remove_initial_comment(self):
         for comment in self.temp_comments:
             self.remove_comment(comment)
@@ -369,9 +506,11 @@ class GitProvider:
         except Exception as e:
             logger.exception(f"Failed to remove comment, error: {e}")
 
+    def _load_languages(self):
+        return self.project.languages()
+
     def get_languages(self):
-        languages = self.git.projects.get(self.project_id).languages()
-        return languages
+        return self.context.get("languages", self._load_languages)
 
     def get_mr_branch(self):
         return self.mr.source_branch
@@ -436,7 +575,7 @@ class GitProvider:
             str: A string containing the commit messages of the merge request.
         """
         try:
-            commit_messages_list = [commit["message"] for commit in self.mr.commits()._list]
+            commit_messages_list = [commit["message"] for commit in self._get_commits()]
             commit_messages_str = "\n".join([f"{i + 1}. {message}" for i, message in enumerate(commit_messages_list)])
         except Exception:
             commit_messages_str = ""
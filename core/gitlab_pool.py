@@ -0,0 +1,79 @@
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import gitlab
+import requests
+
+from config import CONFIG
+from utils import *
+
+_CLIENTS: OrderedDict[tuple[str, str], tuple[gitlab.Gitlab, float]] = OrderedDict()
+_CLIENTS_LOCK = threading.Lock()
+
+
+def _is_rate_limited(ex):
+    return isinstance(ex, gitlab.exceptions.GitlabError) and ex.response_code == 429
+
+
+class _RetryGitlab(gitlab.Gitlab):
+    """
+    临时故障时按统一的重试策略（带抖动的指数退避以及重试预算）重试的GitLab客户端，关闭python-gitlab自带的重试避免叠加。
+    POST请求不是幂等的，只在限流（请求没有被处理）时重试；GitLab请求都在线程中执行，重试的等待不会阻塞事件循环
+    """
+
+    def http_request(self, verb, path, *args, **kwargs):
+        kwargs.update(retry_transient_errors=False, obey_rate_limit=False)
+        retryable = _is_rate_limited if verb.lower() == "post" else is_retryable
+        return call_with_retry(super().http_request, retryable=retryable)(verb, path, *args, **kwargs)
+
+
+def _create_client(git_base, token):
+    """
+    创建GitLab客户端，连接池大小与并发获取文件的线程数保持一致，避免并发请求时连接被丢弃重建
+
+    Args:
+        git_base (str): gitlab的地址
+        token (str): 访问密钥
+
+    Returns:
+        gitlab.Gitlab
+    """
+    client = _RetryGitlab(url=git_base, oauth_token=token)
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=CONFIG.config.git_max_workers, pool_maxsize=CONFIG.config.git_max_workers
+    )
+    client.session.mount("http://", adapter)
+    client.session.mount("https://", adapter)
+    # 客户端可能在被淘汰后仍被执行中的命令使用，只有在不再被引用（被回收）时才关闭会话
+    weakref.finalize(client, client.session.close)
+    return client
+
+
+def get_gitlab_client(git_base, token):
+    """
+    从LRU池中获取已认证的GitLab客户端（同一个实例和token复用同一个HTTP会话以及长连接），
+    超过空闲时间或者超出池大小的客户端会被移出池，其会话在客户端不再被使用后才会关闭
+
+    Args:
+        git_base (str): gitlab的地址
+        token (str): 访问密钥
+
+    Returns:
+        gitlab.Gitlab
+    """
+    key = (git_base, token)
+    now = time.monotonic()
+    with _CLIENTS_LOCK:
+        for k, (_, last_used) in list(_CLIENTS.items()):
+            if now - last_used > CONFIG.config.git_client_idle_timeout:
+                del _CLIENTS[k]
+        if key in _CLIENTS:
+            client = _CLIENTS.pop(key)[0]
+        else:
+            client = _create_client(git_base, token)
+        _CLIENTS[key] = (client, now)
+        while len(_CLIENTS) > CONFIG.config.git_client_pool_size:
+            _CLIENTS.popitem(last=False)
+    return client
@@ -0,0 +1,122 @@
+import fnmatch
+import os
+import re
+import threading
+import tomllib
+
+from config import CONFIG
+from utils import *
+
+
+class IgnoreMatcher:
+    """
+    忽略规则的匹配器：所有glob和正则表达式预先编译为一个组合的正则表达式，一次匹配即可判断文件是否被忽略
+    """
+
+    def __init__(self, globs, regexes):
+        """
+
+        Args:
+            globs (Iterable[str]): glob规则
+            regexes (Iterable[str]): 正则表达式规则
+        """
+        patterns = []
+        for pattern in [*regexes, *(fnmatch.translate(glob) for glob in globs)]:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                logger.warning(f"Invalid ignore pattern {pattern!r}: {e}")
+                continue
+            patterns.append(pattern)
+        try:
+            self._patterns = [re.compile("|".join(f"(?:{pattern})" for pattern in patterns))] if patterns else []
+        except re.error:
+            # 带有全局标志（例如开头的`(?i)`）的正则表达式不能组合，只能逐个匹配
+            self._patterns = [re.compile(pattern) for pattern in patterns]
+
+    def match(self, filename):
+        """
+        判断文件是否被忽略（与re.match一致，从文件路径的开头匹配）
+
+        Args:
+            filename (str):
+
+        Returns:
+            bool
+        """
+        return any(pattern.match(filename) for pattern in self._patterns)
+
+
+# (全局规则, 项目规则文件的修改时间): 匹配器
+_MATCHERS: dict[tuple, IgnoreMatcher] = {}
+_MATCHERS_LOCK = threading.Lock()
+
+
+def _project_rules_path(project):
+    """
+    项目级忽略规则文件的路径：`<ignore.dir>/<项目路径>.toml`，例如`settings/ignore/group/project.toml`
+
+    Args:
+        project (str | None): 项目路径
+
+    Returns:
+        str | None: 项目路径不合法时为None
+    """
+    if not project or any(part in ("", ".", "..") for part in project.split("/")):
+        return None
+    return os.path.join(CONFIG.ignore.dir, *project.split("/")) + ".toml"
+
+
+def _load_project_rules(path):
+    """
+    读取项目级忽略规则，文件中可以配置glob、regex以及inherit（为false时不使用全局规则）
+
+    Args:
+        path (str):
+
+    Returns:
+        dict
+    """
+    try:
+        with open(path, "rb") as f:
+            return tomllib.load(f)
+    except (OSError, tomllib.TOMLDecodeError) as e:
+        logger.error(f"Could not load ignore rules {path}: {e}")
+        return {}
+
+
+def get_ignore_matcher(project=None):
+    """
+    获取全局以及项目级忽略规则的匹配器：只在规则变化（全局配置的内容或者项目规则文件的修改时间变化）时重新编译
+
+    Args:
+        project (str | None): 项目路径
+
+    Returns:
+        IgnoreMatcher
+    """
+    rules = (tuple(CONFIG.ignore.glob), tuple(CONFIG.ignore.regex))
+    path = _project_rules_path(project)
+    try:
+        mtime = os.stat(path).st_mtime_ns if path else None
+    except OSError:
+        path = mtime = None
+    key = (rules, path, mtime)
+    with _MATCHERS_LOCK:
+        if (matcher := _MATCHERS.get(key)) is not None:
+            return matcher
+
+    globs, regexes = rules
+    if path:
+        project_rules = _load_project_rules(path)
+        if not project_rules.get("inherit", True):
+            globs, regexes = (), ()
+        globs = [*globs, *project_rules.get("glob", [])]
+        regexes = [*regexes, *project_rules.get("regex", [])]
+    matcher = IgnoreMatcher(globs, regexes)
+    with _MATCHERS_LOCK:
+        # 同一个项目的规则文件修改后，旧版本的匹配器不会再被使用
+        for stale in [k for k in _MATCHERS if k[1] == path and k != key]:
+            del _MATCHERS[stale]
+        _MATCHERS[key] = matcher
+    return matcher
@@ -0,0 +1,356 @@
+import asyncio
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from utils import *
+
+# 当前正在执行的任务(队列, 任务ID, 第几次执行)，用于在执行过程中给任务标记实际使用的head sha
+_CURRENT_JOB: contextvars.ContextVar[tuple["JobQueue", int, int] | None] = contextvars.ContextVar(
+    "current_job", default=None
+)
+
+
+class JobQueue:
+    """
+    基于SQLite的本地持久化任务队列：固定数量的worker并发消费，按项目公平调度，
+    进程崩溃或者执行失败（执行函数抛出临时故障的异常）的任务会重新执行，失败的任务按指数退避延迟执行，
+    超过最大执行次数或者异常不可重试时标记为失败；
+    同一个MR出现新的head时，基于旧head执行中的任务会被取消并重新排队，队列中重复的任务会被合并
+    """
+
+    def __init__(self, path, workers, max_attempts, handler, secret_keys=(), retry_delay=30):
+        """
+
+        Args:
+            path (str): SQLite数据库文件路径
+            workers (int): 并发执行任务的worker数量
+            max_attempts (int): 每个任务最多执行的次数
+            handler (Callable[[dict], Awaitable]): 任务的执行函数，参数为入队时的payload
+            secret_keys (Iterable[str]): payload中的敏感字段（例如访问密钥），任务失败后不再保留
+            retry_delay (float): 失败的任务第一次重新执行前等待的时间(秒)，之后每次翻倍
+        """
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.handler = handler
+        self.secret_keys = tuple(secret_keys)
+        self._lock = threading.Lock()
+        self._event = asyncio.Event()
+        self._tasks = []
+        self._running: dict[int, tuple[asyncio.Task, str | None, str | None]] = {}  # job_id: (task, mr, head_sha)
+        self._superseded: set[int] = set()
+        self.superseded = 0
+        if directory := os.path.dirname(path):
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, project TEXT NOT NULL, payload TEXT NOT NULL, "
+            "status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(job)")}
+        for column in ("mr", "kind", "head_sha"):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE job ADD COLUMN {column} TEXT")
+        if "not_before" not in columns:
+            # 任务最早可以执行的时间（失败后的退避）
+            self._conn.execute("ALTER TABLE job ADD COLUMN not_before REAL NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_job_status ON job (status, project)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_job_mr ON job (mr, status)")
+
+    def enqueue(self, project, payload, mr=None, kind=None, head_sha=None):
+        """
+        添加任务（同一个MR上相同的待执行任务会被合并，基于其他head执行中的任务会被取消并重新排队）
+
+        Args:
+            project (str): 任务所属的项目（用于公平调度）
+            payload (dict): 任务参数
+            mr (str | None): 任务所属的MR
+            kind (str | None): 任务的类型（命令以及参数），同一个MR上类型相同的待执行任务只保留最新的
+            head_sha (str | None): 任务创建时MR的head sha
+
+        Returns:
+            int: 任务ID
+        """
+        now = time.time()
+        with self._lock:
+            if mr and kind:
+                # 任务执行时总是基于MR最新的版本，所以排队中的同类任务只需要保留一个
+                cursor = self._conn.execute(
+                    "DELETE FROM job WHERE status = 'pending' AND mr = ? AND kind = ?", (mr, kind)
+                )
+                self.superseded += cursor.rowcount
+            cursor = self._conn.execute(
+                "INSERT INTO job (project, payload, mr, kind, head_sha, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (project, json.dumps(payload), mr, kind, head_sha, now, now),
+            )
+        if mr and head_sha:
+            self.supersede(mr, head_sha)
+        self._event.set()
+        return cursor.lastrowid
+
+    def supersede(self, mr, head_sha):
+        """
+        MR出现新的head时取消基于旧head执行中的任务（取消的任务会重新排队，执行时使用最新的版本）
+
+        Args:
+            mr (str):
+            head_sha (str): 最新的head sha
+
+        Returns:
+            int: 被取消的任务数量
+        """
+        stale = [
+            (job_id, task)
+            for job_id, (task, job_mr, job_head) in self._running.items()
+            if job_mr == mr and job_head and job_head != head_sha and job_id not in self._superseded
+        ]
+        for job_id, task in stale:
+            logger.info(f"Job {job_id} superseded by new head {head_sha} of {mr}")
+            self._superseded.add(job_id)
+            task.cancel()
+        return len(stale)
+
+    def tag(self, job_id, head_sha):
+        """
+        标记任务实际使用的head sha（之后收到该MR更新的head时会取消该任务）
+
+        Args:
+            job_id (int):
+            head_sha (str):
+
+        Returns:
+            None
+        """
+        if job_id not in self._running:
+            return
+        task, mr, _ = self._running[job_id]
+        self._running[job_id] = (task, mr, head_sha)
+        with self._lock:
+            self._conn.execute("UPDATE job SET head_sha = ? WHERE id = ?", (head_sha, job_id))
+
+    def _claim(self):
+        """
+        领取一个待执行（并且已经过了退避时间）的任务：优先选择正在执行的任务最少的项目，同一项目内先进先出
+
+        Returns:
+            tuple[int, dict, str | None, str | None, int] | None: 任务ID, 任务参数, MR, head sha, 第几次执行
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, payload, mr, head_sha, attempts FROM job WHERE status = 'pending' AND not_before <= ? "
+                    "ORDER BY (SELECT COUNT(*) FROM job AS running WHERE running.status = 'running' "
+                    "AND running.project = job.project), id LIMIT 1",
+                    (time.time(),),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE job SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                        (time.time(), row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return (row[0], json.loads(row[1]), row[2], row[3], row[4] + 1) if row else None
+
+    def _next_wakeup(self, timeout):
+        """
+        距离最早的退避中的任务可以执行还需要等待的时间
+
+        Args:
+            timeout (float): 最长的等待时间
+
+        Returns:
+            float
+        """
+        with self._lock:
+            (not_before,) = self._conn.execute("SELECT MIN(not_before) FROM job WHERE status = 'pending'").fetchone()
+        return timeout if not_before is None else min(timeout, max(0.0, not_before - time.time()))
+
+    def _finish(self, job_id, status, retryable=True):
+        """
+        任务执行结束：成功的任务直接删除，失败的任务可以重试并且未超过最大次数时延迟重新排队，
+        被取代的任务立即重新排队(不计执行次数)
+
+        Args:
+            job_id (int):
+            status (str): done | failed | superseded
+            retryable (bool): 失败的原因是否为临时故障，不是时直接标记为失败
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if status == "done":
+                self._conn.execute("DELETE FROM job WHERE id = ?", (job_id,))
+            elif status == "superseded":
+                self.superseded += 1
+                # 同一个MR上已经有同类的待执行任务时直接丢弃
+                cursor = self._conn.execute(
+                    "DELETE FROM job WHERE id = ? AND EXISTS (SELECT 1 FROM job AS other WHERE other.status = 'pending' "
+                    "AND other.mr = job.mr AND other.kind = job.kind)",
+                    (job_id,),
+                )
+                if not cursor.rowcount:
+                    self._conn.execute(
+                        "UPDATE job SET status = 'pending', attempts = attempts - 1, head_sha = NULL, updated_at = ? "
+                        "WHERE id = ?",
+                        (time.time(), job_id),
+                    )
+            else:
+                now = time.time()
+                self._conn.execute(
+                    "UPDATE job SET status = CASE WHEN ? AND attempts < ? THEN 'pending' ELSE 'failed' END, "
+                    "not_before = ? + ? * (1 << (attempts - 1)), updated_at = ? WHERE id = ?",
+                    (retryable, self.max_attempts, now, self.retry_delay, now, job_id),
+                )
+                self._redact_failed(job_id)
+
+    def _redact_failed(self, job_id=None):
+        """
+        删除失败（不会再执行）的任务参数中的敏感字段，调用时需要持有self._lock
+
+        Args:
+            job_id (int | None): 任务ID，为None时处理所有失败的任务
+
+        Returns:
+            None
+        """
+        if not self.secret_keys:
+            return
+        sql = "SELECT id, payload FROM job WHERE status = 'failed'"
+        rows = self._conn.execute(sql + " AND id = ?", (job_id,)) if job_id else self._conn.execute(sql)
+        for row_id, payload in rows.fetchall():
+            data = json.loads(payload)
+            if any(key in data for key in self.secret_keys):
+                redacted = {k: v for k, v in data.items() if k not in self.secret_keys}
+                self._conn.execute("UPDATE job SET payload = ? WHERE id = ?", (json.dumps(redacted), row_id))
+
+    def _recover(self):
+        """
+        将上次进程退出时仍处于执行中的任务重新排队（超过最大执行次数的标记为失败）
+
+        Returns:
+            int: 重新排队的任务数量
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE job SET status = 'failed' WHERE status = 'running' AND attempts >= ?", (self.max_attempts,)
+            )
+            cursor = self._conn.execute("UPDATE job SET status = 'pending' WHERE status = 'running'")
+            self._redact_failed()
+        return cursor.rowcount
+
+    async def _worker(self):
+        while True:
+            # 先清除通知再领取任务，领取之后新入队的任务会重新设置通知
+            self._event.clear()
+            if (job := await asyncio.to_thread(self._claim)) is None:
+                # 兜底的轮询，防止错过通知以及退避结束的任务（不使用wait_for，停止时取消worker不会卡在等待内部任务结束上）
+                timeout = await asyncio.to_thread(self._next_wakeup, 5)
+                waiter = asyncio.ensure_future(self._event.wait())
+                try:
+                    await asyncio.wait({waiter}, timeout=timeout)
+                finally:
+                    waiter.cancel()
+                continue
+            job_id, payload, mr, head_sha, attempt = job
+            context = contextvars.copy_context()
+            context.run(_CURRENT_JOB.set, (self, job_id, attempt))
+            task = asyncio.create_task(self.handler(payload), context=context)
+            self._running[job_id] = (task, mr, head_sha)
+            retryable = True
+            try:
+                await task
+                status = "done"
+            except asyncio.CancelledError:
+                if job_id not in self._superseded:
+                    # 停止服务时中断的任务保持running状态，重启后重新执行
+                    task.cancel()
+                    raise
+                status = "superseded"
+            except Exception as ex:
+                retryable = is_retryable(ex)
+                logger.exception(f"Job {job_id} failed{'' if retryable else ' (not retryable)'}: {ex}")
+                status = "failed"
+            finally:
+                self._running.pop(job_id, None)
+                self._superseded.discard(job_id)
+            await asyncio.to_thread(self._finish, job_id, status, retryable)
+            if status != "done":
+                # asyncio.Event不是线程安全的，只能在事件循环的线程中通知其他worker
+                self._event.set()
+
+    async def start(self):
+        """
+        启动worker
+
+        Returns:
+            None
+        """
+        if recovered := self._recover():
+            logger.info(f"{recovered} unfinished jobs requeued")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """
+        停止worker
+
+        Returns:
+            None
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self):
+        """
+        各状态的任务数量
+
+        Returns:
+            dict[str, int]
+        """
+        with self._lock:
+            stats = dict(self._conn.execute("SELECT status, COUNT(*) FROM job GROUP BY status").fetchall())
+        stats["superseded"] = self.superseded
+        return stats
+
+
+def tag_current_job(head_sha):
+    """
+    给当前正在执行的任务标记实际使用的head sha（不在任务队列中执行时忽略）
+
+    Args:
+        head_sha (str):
+
+    Returns:
+        None
+    """
+    if job := _CURRENT_JOB.get():
+        queue, job_id, _ = job
+        queue.tag(job_id, head_sha)
+
+
+def is_final_attempt():
+    """
+    当前任务失败后是否不会再重新执行（不在任务队列中执行时总是最后一次）
+
+    Returns:
+        bool
+    """
+    if job := _CURRENT_JOB.get():
+        queue, _, attempt = job
+        return attempt >= queue.max_attempts
+    return True
@@ -0,0 +1,43 @@
+import asyncio
+
+from utils import *
+
+
+class SingleFlight:
+    """
+    合并同时进行的相同调用：相同key的调用在执行期间只会执行一次，后来的调用直接等待并共享同一个结果；
+    所有等待者都被取消时才会取消实际的调用
+    """
+
+    def __init__(self):
+        self._in_flight: dict[tuple, asyncio.Task] = {}
+        self._waiters: dict[tuple, int] = {}
+
+    async def do(self, key, factory):
+        """
+        执行调用（相同key的调用正在执行时直接等待其结果）
+
+        Args:
+            key (tuple): 调用的唯一标识
+            factory (Callable[[], Awaitable]): 生成实际调用的函数
+
+        Returns:
+            Any: 调用的结果
+        """
+        if (task := self._in_flight.get(key)) is None:
+            task = asyncio.ensure_future(factory())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            logger.info(f"Coalesced with in-flight call: {key=}")
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            # 某一个等待者被取消时不影响其他等待者共享的调用
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[key] == 1:
+                task.cancel()
+            raise
+        finally:
+            if (waiters := self._waiters.pop(key) - 1) > 0:
+                self._waiters[key] = waiters
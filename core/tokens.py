@@ -1,7 +1,32 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
 from tiktoken import get_encoding
 
 from config import CONFIG
 
+_ENCODER = None
+_ENCODER_LOCK = threading.Lock()
+# 内容哈希到tokens数量的LRU缓存
+_TOKEN_COUNTS: OrderedDict[bytes, int] = OrderedDict()
+_TOKEN_COUNTS_LOCK = threading.Lock()
+
+
+def get_encoder():
+    """
+    获取进程内共享的编码器（只在第一次调用时加载，应用启动时预先加载）
+
+    Returns:
+        tiktoken.Encoding
+    """
+    global _ENCODER
+    if _ENCODER is None:
+        with _ENCODER_LOCK:
+            if _ENCODER is None:
+                _ENCODER = get_encoding("o200k_base")  # cl100k_base
+    return _ENCODER
+
 
 class TokenHandler:
     """
@@ -16,13 +41,13 @@ class TokenHandler:
             system (str): system prompt
             user (str): user prompt
         """
-        self.encoder = get_encoding("o200k_base")  # cl100k_base
+        self.encoder = get_encoder()
         self.prompt_tokens = self.count_tokens(system) + self.count_tokens(user)
         self.max_tokens: int = CONFIG.config.max_model_tokens
 
     def count_tokens(self, text):
         """
-        计算指定字符串的tokens数量
+        计算指定字符串的tokens数量（按内容哈希缓存，相同的内容只编码一次）
 
         Args:
             text (str): 指定字符串。
@@ -30,4 +55,43 @@ class TokenHandler:
         Returns:
             int: tokens数量。
         """
-        return len(self.encoder.encode(text, disallowed_special=()))
+        return self.count_tokens_batch([text])[0]
+
+    def count_tokens_batch(self, texts):
+        """
+        批量计算多个字符串的tokens数量：未缓存的内容通过编码器的批量接口在线程池中一次性编码
+
+        Args:
+            texts (list[str]):
+
+        Returns:
+            list[int]: 与texts顺序一致的tokens数量
+        """
+        keys = [
+            hashlib.blake2b(text.encode("utf-8", errors="surrogatepass"), digest_size=16).digest() for text in texts
+        ]
+        counts = [None] * len(texts)
+        missing = {}  # key: 第一次出现的位置，相同的内容只编码一次
+        with _TOKEN_COUNTS_LOCK:
+            for i, key in enumerate(keys):
+                if (count := _TOKEN_COUNTS.get(key)) is not None:
+                    _TOKEN_COUNTS.move_to_end(key)
+                    counts[i] = count
+                else:
+                    missing.setdefault(key, i)
+        if missing:
+            pending = [texts[i] for i in missing.values()]
+            if len(pending) == 1:
+                encoded = [self.encoder.encode(pending[0], disallowed_special=())]
+            else:
+                encoded = self.encoder.encode_batch(
+                    pending, num_threads=CONFIG.config.token_threads, disallowed_special=()
+                )
+            computed = dict(zip(missing, map(len, encoded)))
+            with _TOKEN_COUNTS_LOCK:
+                for key, count in computed.items():
+                    _TOKEN_COUNTS[key] = count
+                while len(_TOKEN_COUNTS) > CONFIG.config.token_cache_size:
+                    _TOKEN_COUNTS.popitem(last=False)
+            counts = [computed[key] if count is None else count for key, count in zip(keys, counts)]
+        return counts
@@ -5,6 +5,8 @@ from config import CONFIG
 # Language Selection, source: https://github.com/bigcode-project/bigcode-dataset/blob/main/language_selection/programming-languages-to-file-extensions.json  # noqa E501
 
 LANGUAGE_EXTENSION_MAP = {k.lower(): set(v) for k, v in CONFIG.language_extension_map_org.items()}
+# 扩展名（或者Makefile等完整的文件名）到语言名称的反向索引，语言名称与GitLab languages接口返回的一致
+EXTENSION_LANGUAGE_MAP = {ext: k for k, v in CONFIG.language_extension_map_org.items() for ext in v}
 
 # Bad Extensions, source: https://github.com/EleutherAI/github-downloader/blob/345e7c4cbb9e0dc8a0615fd995a08bf9d73b3fe6/download_repo_text.py  # noqa: E501
 BAD_EXTENSIONS = set(CONFIG.bad_extensions.default + CONFIG.bad_extensions.extra)
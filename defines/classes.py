@@ -1,21 +1,99 @@
 from dataclasses import dataclass
+from dataclasses import field
 
 from pydantic import BaseModel
 from pydantic import Field
 
 from .enums import *
+from config import CONFIG
 
 
+class LazyContent:
+    """
+    文件内容的延迟加载描述符：可以赋值为字符串或者无参的加载函数，加载函数在第一次访问时才调用，结果会被缓存
+    """
+
+    def __set_name__(self, owner, name):
+        self.attr = f"_{name}"
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.attr]
+        if callable(value):
+            value = instance.__dict__[self.attr] = value()
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.attr] = value
+
+
+def lazy_content(*names):
+    """
+    类装饰器: 将dataclass的指定字段改为延迟加载（放在@dataclass之上，dataclass会删除没有默认值的字段的类属性）
+
+    Args:
+        names (str): 字段名称
+
+    Returns:
+        Callable[[type], type]
+    """
+
+    def wrap(cls):
+        for name in names:
+            descriptor = LazyContent()
+            descriptor.__set_name__(cls, name)
+            setattr(cls, name, descriptor)
+        return cls
+
+    return wrap
+
+
+@lazy_content("base_file", "head_file")
 @dataclass
 class FilePatchInfo:
-    base_file: str | None
-    head_file: str | None
+    # 文件内容不参与repr和比较，打印日志或者比较文件时不会触发下载
+    base_file: str | None = field(repr=False, compare=False)
+    head_file: str | None = field(repr=False, compare=False)
     patch: str | None
     filename: str
     tokens: int = -1
     edit_type: EditType = EditType.UNKNOWN
     old_filename: str = None
 
+    def is_loaded(self, attr):
+        """
+        判断文件内容是否已经加载
+
+        Args:
+            attr (str): base_file | head_file
+
+        Returns:
+            bool
+        """
+        return not callable(self.__dict__[f"_{attr}"])
+
+
+@dataclass
+class HunkInfo:
+    file: FilePatchInfo
+    header: str  # @@ -start,size +start,size @@ section，补丁开头不属于任何hunk的内容时为空字符串
+    lines: list[str]
+    index: int  # 在文件中的序号
+    tokens: int = -1
+    score: float = 0.0
+
+    @property
+    def added(self):
+        return sum(1 for line in self.lines if line.startswith("+"))
+
+    @property
+    def deleted(self):
+        return sum(1 for line in self.lines if line.startswith("-"))
+
+    def __str__(self):
+        return "\n".join([self.header, *self.lines] if self.header else self.lines)
+
 
 @dataclass
 class LanguageInfo:
@@ -116,6 +194,10 @@ class CommandParams(BaseModel):
     extra_instructions: str = Field("", alias="e", alias_priority=0, description="附加的prompts")
     ai_temperature: float = Field(0.2, description="模型温度")
     patch_extra_lines: int = Field(0, description="获取提交的代码差异时在代码周围额外附加的代码行数")
+    stream: bool = Field(CONFIG.config.ai_stream, description="流式获取AI响应并逐步更新执行中的评论")
+    chunked: bool = Field(
+        CONFIG.config.chunked_review, description="MR超出tokens上限时分批并发审查全部差异并合并结果，否则修剪差异"
+    )
 
     def __str__(self):
         result = ""
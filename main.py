@@ -1,7 +1,32 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 import uvicorn
 from fastapi import FastAPI
 
+from api import JOB_QUEUE
 from api import router
+from core import AiHandler
+from core import get_encoder
+from core import get_ignore_matcher
+from utils import logger
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    """
+    应用生命周期：启动时预先加载tokens编码器、编译全局忽略规则并开始消费任务队列，退出时停止worker并释放共享的连接池资源
+    """
+    try:
+        await asyncio.to_thread(get_encoder)
+    except Exception as ex:
+        # 加载失败时在第一次计算tokens时重新加载
+        logger.warning(f"Failed to load token encoder: {ex!r}")
+    get_ignore_matcher()
+    await JOB_QUEUE.start()
+    yield
+    await JOB_QUEUE.stop()
+    await AiHandler.close()
 
 
 def create_app():
@@ -11,7 +36,7 @@ def create_app():
     Returns:
         FastAPI: 添加上路由信息的APP。
     """
-    _app = FastAPI(title="MR-Agent", description="", version="main")
+    _app = FastAPI(title="MR-Agent", description="", version="main", lifespan=lifespan)
     _app.include_router(router)
 
     return _app
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+# 测试不写入项目的日志文件（utils导入时会按log.dir配置添加文件日志），只输出到标准错误由pytest捕获
+os.environ["LOG__DIR"] = ""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class _FakeEncoder:
+    """
+    每4个字符算作一个token的编码器（测试环境不下载tiktoken的词表）
+    """
+
+    @staticmethod
+    def encode(text, disallowed_special=()):
+        return [text[i : i + 4] for i in range(0, len(text), 4)]
+
+    @staticmethod
+    def decode(tokens, errors="strict"):
+        return "".join(tokens)
+
+
+class FakeTokenHandler:
+    def __init__(self, max_tokens=100000, prompt_tokens=100):
+        self.max_tokens = max_tokens
+        self.prompt_tokens = prompt_tokens
+        self.encoder = _FakeEncoder()
+
+    def count_tokens(self, text):
+        return len(self.encoder.encode(text))
+
+    def count_tokens_batch(self, texts):
+        return [self.count_tokens(text) for text in texts]
+
+
+@pytest.fixture
+def token_handler():
+    return FakeTokenHandler()
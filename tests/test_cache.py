@@ -0,0 +1,45 @@
+import asyncio
+
+import core.cache
+from core.cache import ResponseCache
+
+
+def test_cache_hit_and_miss(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"), ttl=3600, max_entries=10)
+    assert cache.get("a") is None
+    cache.set("a", "response")
+    assert cache.get("a") == "response"
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_cache_hit_touches_only_after_interval(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path / "cache.db"), ttl=3600, max_entries=10)
+    cache.set("a", "response")
+    (accessed_at,) = cache._conn.execute("SELECT accessed_at FROM ai_response").fetchone()
+    cache.get("a")
+    assert cache._conn.execute("SELECT accessed_at FROM ai_response").fetchone() == (accessed_at,)
+
+    monkeypatch.setattr(core.cache, "TOUCH_INTERVAL", 0)
+    cache.get("a")
+    assert cache._conn.execute("SELECT accessed_at FROM ai_response").fetchone()[0] > accessed_at
+
+
+def test_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(core.cache, "TOUCH_INTERVAL", 0)
+    cache = ResponseCache(str(tmp_path / "cache.db"), ttl=3600, max_entries=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1" and cache.get("c") == "3"
+
+
+def test_cache_usable_from_threads(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"), ttl=3600, max_entries=10)
+
+    async def main():
+        await asyncio.gather(*(asyncio.to_thread(cache.set, str(i), str(i)) for i in range(5)))
+        return await asyncio.gather(*(asyncio.to_thread(cache.get, str(i)) for i in range(5)))
+
+    assert asyncio.run(main()) == [str(i) for i in range(5)]
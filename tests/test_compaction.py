@@ -0,0 +1,68 @@
+from core.compaction import compact_patches
+from defines import FilePatchInfo
+
+MOVED_PY = ["total = 0", "for item in items:", "    total += item.price", "    count += item.quantity", "return total"]
+
+
+def _patch(*lines, start=10):
+    context = [f" context_line_{i}" for i in range(3)]
+    body = [*context, *lines, *context]
+    old = sum(1 for line in body if line[0] in " -")
+    new = sum(1 for line in body if line[0] in " +")
+    return "\n".join([f"@@ -{start},{old} +{start},{new} @@", *body])
+
+
+def _file(filename, *lines, start=10):
+    return FilePatchInfo("", "", _patch(*lines, start=start), filename)
+
+
+def test_whitespace_inside_line_is_kept(token_handler):
+    file = _file("a.js", "-s = 'a  b'", "+s = 'a b'")
+    patch, notes = compact_patches([file], token_handler)["a.js"]
+    assert patch == file.patch
+    assert not notes
+
+
+def test_reindent_only_hunk_is_collapsed(token_handler):
+    file = _file("a.js", "-if (x) {", "-return 1", "+  if (x) {", "+      return 1  ")
+    patch, notes = compact_patches([file], token_handler)["a.js"]
+    assert patch == ""
+    assert notes == ["第10行附近只涉及空白字符的修改已省略"]
+
+
+def test_reindent_is_kept_for_indent_sensitive_files(token_handler):
+    file = _file("a.py", "-return 1", "+    return 1")
+    assert compact_patches([file], token_handler)["a.py"] == (file.patch, [])
+
+
+def test_trailing_whitespace_is_collapsed_for_indent_sensitive_files(token_handler):
+    file = _file("a.py", "-    return 1", "+    return 1   ")
+    patch, notes = compact_patches([file], token_handler)["a.py"]
+    assert patch == ""
+    assert len(notes) == 1
+
+
+def test_dedented_python_block_is_not_a_move(token_handler):
+    removed = _file("a.py", *(f"-    {line}" for line in MOVED_PY))
+    added = _file("b.py", *(f"+{line}" for line in MOVED_PY), start=50)
+    result = compact_patches([removed, added], token_handler)
+    assert result["a.py"] == (removed.patch, [])
+    assert result["b.py"] == (added.patch, [])
+
+
+def test_reindented_block_is_a_move_in_other_languages(token_handler):
+    lines = [line.replace("for item in items:", "for (const item of items) {") + ";" for line in MOVED_PY]
+    removed = _file("a.js", *(f"-    {line}" for line in lines))
+    added = _file("b.js", *(f"+{line}" for line in lines), start=50)
+    result = compact_patches([removed, added], token_handler)
+    assert result["a.js"][0] == "" and "移动到了b.js第53行" in result["a.js"][1][0]
+    assert result["b.js"][0] == "" and "移动自a.js第13行且内容未改变" in result["b.js"][1][0]
+
+
+def test_context_is_trimmed_only_over_budget(token_handler):
+    context = [f" line_{i}" for i in range(20)]
+    file = FilePatchInfo("", "", "\n".join(["@@ -1,41 +1,41 @@", *context, "-x = 1", "+x = 2", *context]), "a.js")
+    assert compact_patches([file], token_handler, context_budget=100000)["a.js"] == (file.patch, [])
+    assert compact_patches([file], token_handler, context_budget=None)["a.js"] == (file.patch, [])
+    trimmed, _ = compact_patches([file], token_handler, context_budget=10)["a.js"]
+    assert trimmed.splitlines()[0] == "@@ -18,7 +18,7 @@"
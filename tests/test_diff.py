@@ -0,0 +1,106 @@
+from conftest import FakeTokenHandler
+
+from core.diff import _clip_diff
+from core.diff import _parse_hunks
+from core.diff import _relative_churn
+from core.diff import _split_batches
+from core.diff import _split_patch
+from core.diff import DELETED_FILES_
+from core.diff import MODIFIED_FILES_
+from core.diff import PARTIAL_FILES_
+from core.diff import TOKENS_SOFT_BUFFER_THRESHOLD
+from defines import EditType
+from defines import FilePatchInfo
+from defines import LanguageInfo
+
+
+def _hunk(start, added, deleted=0, name="line"):
+    lines = [f"-{name}_old_{i}" for i in range(deleted)] + [f"+{name}_new_{i}" for i in range(added)]
+    return "\n".join([f"@@ -{start},{deleted} +{start},{added} @@", *lines])
+
+
+def _file(filename, *hunks, edit_type=EditType.MODIFIED, base_file=""):
+    return FilePatchInfo(base_file, "", "\n".join(hunks), filename, edit_type=edit_type)
+
+
+def _handler(budget):
+    # 预算 = max_tokens - prompt_tokens - TOKENS_SOFT_BUFFER_THRESHOLD
+    return FakeTokenHandler(max_tokens=budget + 100 + TOKENS_SOFT_BUFFER_THRESHOLD, prompt_tokens=100)
+
+
+def _clip(files, budget, max_batches=1):
+    compacted = {file.filename: (file.patch, []) for file in files}
+    return _clip_diff([LanguageInfo("Python", files)], compacted, _handler(budget), False, max_batches)
+
+
+def test_split_patch_keeps_every_piece_within_budget(token_handler):
+    file = _file("a.py", _hunk(1, 20, name="first"), _hunk(100, 20, name="second"), _hunk(200, 20, name="third"))
+    budget = 150
+    pieces = _split_patch(file, file.patch, token_handler, budget, False)
+
+    assert len(pieces) > 1
+    assert all(tokens <= budget and token_handler.count_tokens(piece) == tokens for piece, tokens in pieces)
+    assert all(piece.startswith("\n\n## a.py\n") for piece, _ in pieces)
+    # 所有hunk按原有顺序出现在各段中
+    joined = "".join(piece for piece, _ in pieces)
+    assert joined.index("first_new_0") < joined.index("second_new_0") < joined.index("third_new_0")
+
+
+def test_split_patch_clips_hunk_larger_than_budget(token_handler):
+    file = _file("a.py", _hunk(1, 200))
+    ((piece, tokens),) = _split_patch(file, file.patch, token_handler, 50, False)
+    assert tokens == 50 and token_handler.count_tokens(piece) <= 50
+
+
+def test_clip_diff_keeps_valuable_hunks_and_lists_omitted_files():
+    important = _file("core/service.py", _hunk(1, 10, name="important"))
+    partial = _file("core/partial.py", _hunk(1, 8, name="kept"), _hunk(50, 60, name="huge"))
+    tests = _file("tests/test_service.py", _hunk(1, 60, name="test"))
+    deleted = _file("old.py", _hunk(1, 0, deleted=5), edit_type=EditType.DELETED)
+    (diff,) = _clip([important, partial, tests, deleted], budget=150)
+
+    assert "important_new_9" in diff and "kept_new_7" in diff
+    assert "huge_new_0" not in diff and "test_new_0" not in diff
+    assert MODIFIED_FILES_ + "tests/test_service.py" in diff
+    assert PARTIAL_FILES_ + "core/partial.py（省略了1个代码块）" in diff
+    assert diff.endswith(DELETED_FILES_ + "old.py")
+    assert FakeTokenHandler().count_tokens(diff) <= 150
+
+
+def test_clip_diff_fills_multiple_batches_within_budget():
+    files = [_file(f"m{n}.py", _hunk(1, 15, name=f"m{n}")) for n in range(6)]
+    diffs = _clip(files, budget=100, max_batches=3)
+
+    assert len(diffs) == 3
+    assert all(FakeTokenHandler().count_tokens(diff) <= 100 for diff in diffs)
+    # 每个文件只出现在一个批次中，装不下的文件列在最后一批
+    for n in range(6):
+        assert sum(f"## m{n}.py" in diff for diff in diffs) + (f"\nm{n}.py" in diffs[-1]) == 1
+
+
+def test_split_batches_packs_patches_in_order():
+    handler = _handler(50)
+    files = [_file(f"m{n}.py", _hunk(1, 10, name=f"m{n}")) for n in range(4)]
+    patches = []
+    for file in files:
+        full_patch = f"\n\n## {file.filename}\n\n{file.patch}\n"
+        file.tokens = handler.count_tokens(full_patch)
+        patches.append((file, file.patch, full_patch))
+    compacted = {file.filename: (file.patch, []) for file in files}
+    batches = _split_batches([LanguageInfo("Python", files)], patches, compacted, handler, False)
+
+    assert len(batches) > 1
+    assert all(handler.count_tokens(batch) <= 50 for batch in batches)
+    assert "".join(batches).index("m0_new_0") < "".join(batches).index("m3_new_0")
+
+
+def test_relative_churn_uses_loaded_file_length_only():
+    patch = _hunk(1, 3, deleted=2)
+    loaded = _file("a.py", patch, base_file="\n".join(f"line {i}" for i in range(20)))
+    assert _relative_churn(loaded, _parse_hunks(loaded, patch)) == 0.25
+
+    calls = []
+    lazy = _file("a.py", patch, base_file=lambda: calls.append(1) or "")
+    lazy.head_file = lambda: calls.append(1) or ""
+    assert _relative_churn(lazy, _parse_hunks(lazy, patch)) == 0.0
+    assert not calls
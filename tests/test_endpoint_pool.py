@@ -0,0 +1,53 @@
+import asyncio
+
+from config import CONFIG
+from core.endpoint_pool import EndpointPool
+
+
+async def _hang(url):
+    await asyncio.sleep(60)
+
+
+def test_timeouts_open_the_circuit():
+    pool = EndpointPool(["http://a"], lambda ex: True)
+
+    async def run():
+        for _ in range(CONFIG.config.ai_breaker_failures):
+            try:
+                await pool.call(_hang, 0.01)
+            except TimeoutError:
+                pass
+
+    asyncio.run(run())
+    (stats,) = pool.stats()
+    assert stats["failures"] == CONFIG.config.ai_breaker_failures
+    assert stats["open"] and stats["outstanding"] == 0
+    assert "url" not in stats
+
+
+def test_external_cancellation_is_neutral():
+    pool = EndpointPool(["http://a"], lambda ex: True)
+
+    async def run():
+        task = asyncio.create_task(pool.call(_hang, 10))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+    (stats,) = pool.stats()
+    assert stats["failures"] == 0 and stats["outstanding"] == 0
+
+
+def test_only_the_probe_ends_the_half_open_state():
+    pool = EndpointPool(["http://a"], lambda ex: True)
+    (endpoint,) = pool.endpoints
+    old, _ = pool.acquire()  # 熔断之前发出的请求
+    endpoint.opened_at = 0.0  # 熔断已经超过恢复时间
+    probe_endpoint, probe = pool.acquire()
+    assert probe_endpoint is endpoint and probe
+
+    pool.release(old, failed=True)
+    assert not endpoint.available(float("inf"))  # 旧请求结束后试探请求仍在进行中
+    pool.release(endpoint, latency=0.1, probe=True)
+    assert endpoint.opened_at is None and endpoint.available(0.0)
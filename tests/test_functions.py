@@ -0,0 +1,31 @@
+from utils.functions import load_yaml_completed
+from utils.functions import merge_yaml_data
+
+
+def test_load_yaml_completed_stops_before_last_key():
+    text = "```yaml\nreview:\n  summary: ok\n  issues:\n  - a\n  - b\n  score: 8"
+    data, length = load_yaml_completed(text)
+    assert data == {"review": {"summary": "ok", "issues": ["a", "b"]}}
+    assert text.removeprefix("```yaml\n")[:length].endswith("  - b")
+
+
+def test_load_yaml_completed_skips_block_scalar_content():
+    text = "summary: |-\n  first line\n  key: not a key\n  last\nnext: 1"
+    data, _ = load_yaml_completed(text)
+    assert data == {"summary": "first line\nkey: not a key\nlast"}
+
+
+def test_load_yaml_completed_needs_two_boundaries():
+    assert load_yaml_completed("summary: half wri") == (None, 0)
+    assert load_yaml_completed("") == (None, 0)
+
+
+def test_merge_yaml_data():
+    first = {"review": {"summary": "one", "issues": ["a", "b"], "score": None}}
+    second = {"review": {"summary": "two", "issues": ["b", "c"], "score": 7}, "extra": "x"}
+    assert merge_yaml_data([first, second]) == {
+        "review": {"summary": "one", "issues": ["a", "b", "c"], "score": 7},
+        "extra": "x",
+    }
+    assert merge_yaml_data([None, "", {}]) is None
+    assert merge_yaml_data([]) is None
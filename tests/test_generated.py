@@ -0,0 +1,34 @@
+from core.generated import detect_generated_file
+
+
+def _added(*lines, start=1):
+    return "\n".join([f"@@ -0,0 +{start},{len(lines)} @@", *(f"+{line}" for line in lines)])
+
+
+def test_detected_by_filename():
+    assert detect_generated_file("web/package-lock.json", None) == "依赖锁文件"
+    assert detect_generated_file("static/app.min.js", None) == "生成的文件"
+    assert detect_generated_file("proto/user_pb2.py", None) == "生成的文件"
+    assert detect_generated_file("vendor/github.com/pkg/errors/errors.go", None) == "第三方代码"
+    assert detect_generated_file("src/service.py", None) is None
+
+
+def test_generated_marker_only_at_file_head():
+    marker = "// Code generated by protoc-gen-go. DO NOT EDIT."
+    assert detect_generated_file("api/user.go", _added(marker, "package api")) == "生成的文件"
+    assert detect_generated_file("api/user.py", _added("# @generated", "x = 1")) == "生成的文件"
+    # 文件中间的标记以及普通的注释不算
+    assert detect_generated_file("api/user.go", _added(marker, start=120)) is None
+    assert detect_generated_file("api/user.go", _added("// generated code is DO NOT EDIT territory")) is None
+
+
+def test_lockfile_signature():
+    assert detect_generated_file("deps/custom.lock", _added("# yarn lockfile v1", "")) == "依赖锁文件"
+
+
+def test_minified_code_by_line_statistics():
+    minified = "var a=function(b){return b*2};" * 20
+    assert detect_generated_file("static/bundle.js", _added(minified, minified)) == "压缩后的代码"
+    prose = " ".join(["long documentation paragraph"] * 20)
+    assert detect_generated_file("docs/guide.md", _added(prose, prose)) is None
+    assert detect_generated_file("src/service.py", _added("def f():", "    return 1")) is None
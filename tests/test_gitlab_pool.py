@@ -0,0 +1,57 @@
+import gitlab
+import pytest
+
+from core.gitlab_pool import _create_client
+
+
+@pytest.fixture
+def responses(monkeypatch):
+    """
+    替换python-gitlab实际发送请求的方法：按顺序返回或者抛出给定的结果，并记录每次调用的参数
+    """
+    calls = []
+    results = []
+
+    def http_request(self, verb, path, *args, **kwargs):
+        calls.append((verb, kwargs))
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(gitlab.Gitlab, "http_request", http_request)
+    monkeypatch.setattr("utils.retry.time.sleep", lambda _: None)
+    return calls, results
+
+
+def test_get_retries_transient_errors_without_builtin_retry(responses):
+    calls, results = responses
+    results.extend([gitlab.exceptions.GitlabHttpError(response_code=503), "ok"])
+    client = _create_client("http://gitlab.example.com", "token")
+
+    assert client.http_request("get", "/projects") == "ok"
+    assert len(calls) == 2
+    assert all(not kwargs["retry_transient_errors"] and not kwargs["obey_rate_limit"] for _, kwargs in calls)
+
+
+def test_permanent_errors_are_not_retried(responses):
+    calls, results = responses
+    results.append(gitlab.exceptions.GitlabAuthenticationError(response_code=401))
+    client = _create_client("http://gitlab.example.com", "token")
+
+    with pytest.raises(gitlab.exceptions.GitlabAuthenticationError):
+        client.http_request("get", "/projects")
+    assert len(calls) == 1
+
+
+def test_post_is_retried_only_when_rate_limited(responses):
+    calls, results = responses
+    results.extend([gitlab.exceptions.GitlabHttpError(response_code=429), "created"])
+    client = _create_client("http://gitlab.example.com", "token")
+    assert client.http_request("post", "/notes") == "created"
+    assert len(calls) == 2
+
+    results.append(gitlab.exceptions.GitlabHttpError(response_code=502))
+    with pytest.raises(gitlab.exceptions.GitlabHttpError):
+        client.http_request("post", "/notes")
+    assert len(calls) == 3
@@ -0,0 +1,28 @@
+from core.ignore import IgnoreMatcher
+
+
+def test_globs_and_regexes_are_combined():
+    matcher = IgnoreMatcher(["*.md", "docs/*"], [r"^build/", r".*\.snap$"])
+    assert matcher.match("README.md")
+    assert matcher.match("docs/guide.txt")
+    assert matcher.match("build/output.js")
+    assert matcher.match("tests/__snapshots__/a.snap")
+    assert not matcher.match("src/build/main.py")
+    assert not matcher.match("src/main.py")
+
+
+def test_invalid_pattern_is_skipped():
+    matcher = IgnoreMatcher([], [r"(unclosed", r"^vendor/"])
+    assert matcher.match("vendor/lib.js")
+    assert not matcher.match("(unclosed")
+
+
+def test_patterns_with_global_flags_are_matched_one_by_one():
+    matcher = IgnoreMatcher(["*.lock"], [r"(?i)^generated/"])
+    assert matcher.match("Generated/api.py")
+    assert matcher.match("poetry.lock")
+    assert not matcher.match("src/api.py")
+
+
+def test_empty_rules_match_nothing():
+    assert not IgnoreMatcher([], []).match("anything.py")
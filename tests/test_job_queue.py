@@ -0,0 +1,78 @@
+import asyncio
+import json
+import sqlite3
+import time
+
+from core.job_queue import is_final_attempt
+from core.job_queue import JobQueue
+
+
+async def _drain(queue, timeout=5):
+    """
+    等待队列中没有待执行以及执行中的任务
+    """
+    await queue.start()
+    try:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            stats = queue.stats()
+            if not stats.get("pending") and not stats.get("running"):
+                return stats
+            await asyncio.sleep(0.01)
+        raise TimeoutError(queue.stats())
+    finally:
+        await queue.stop()
+
+
+def test_failed_job_is_retried_and_redacted(tmp_path):
+    calls = []
+
+    async def handler(payload):
+        calls.append((is_final_attempt(), time.monotonic()))
+        raise TimeoutError("boom")
+
+    path = str(tmp_path / "jobs.db")
+    queue = JobQueue(path, 2, 3, handler, secret_keys=("token",), retry_delay=0.1)
+    queue.enqueue("group/project", {"token": "secret", "url": "u"})
+    stats = asyncio.run(_drain(queue))
+
+    assert [final for final, _ in calls] == [False, False, True]
+    # 每次重新执行前按指数退避等待
+    assert calls[1][1] - calls[0][1] >= 0.1 and calls[2][1] - calls[1][1] >= 0.2
+    assert stats["failed"] == 1
+    (payload,) = sqlite3.connect(path).execute("SELECT payload FROM job").fetchone()
+    assert json.loads(payload) == {"url": "u"}
+
+
+def test_non_retryable_failure_is_not_retried(tmp_path):
+    calls = []
+
+    async def handler(payload):
+        calls.append(payload)
+        raise KeyError("token")
+
+    path = str(tmp_path / "jobs.db")
+    queue = JobQueue(path, 2, 3, handler, secret_keys=("token",), retry_delay=0.1)
+    queue.enqueue("group/project", {"token": "secret", "url": "u"})
+    stats = asyncio.run(_drain(queue))
+
+    assert len(calls) == 1
+    assert stats["failed"] == 1
+    (payload,) = sqlite3.connect(path).execute("SELECT payload FROM job").fetchone()
+    assert json.loads(payload) == {"url": "u"}
+
+
+def test_successful_job_is_removed(tmp_path):
+    done = []
+
+    async def handler(payload):
+        done.append(payload["n"])
+
+    queue = JobQueue(str(tmp_path / "jobs.db"), 2, 3, handler)
+    for n in range(5):
+        queue.enqueue(f"project{n % 2}", {"n": n})
+    stats = asyncio.run(_drain(queue))
+
+    assert sorted(done) == list(range(5))
+    assert not stats.get("failed")
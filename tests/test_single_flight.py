@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from core.single_flight import SingleFlight
+
+
+def test_concurrent_calls_are_coalesced():
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def main():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do(("key",), factory) for _ in range(3)))
+        # 调用结束后相同的key会重新执行
+        results.append(await flight.do(("key",), factory))
+        return results
+
+    assert asyncio.run(main()) == ["result"] * 4
+    assert len(calls) == 2
+
+
+def test_exception_is_shared():
+    async def factory():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def main():
+        flight = SingleFlight()
+        return await asyncio.gather(*(flight.do(("key",), factory) for _ in range(2)), return_exceptions=True)
+
+    assert [type(result) for result in asyncio.run(main())] == [ValueError, ValueError]
+
+
+def test_call_is_cancelled_only_with_last_waiter():
+    async def main():
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def factory():
+            started.set()
+            await release.wait()
+            return "result"
+
+        flight = SingleFlight()
+        first = asyncio.create_task(flight.do(("key",), factory))
+        second = asyncio.create_task(flight.do(("key",), factory))
+        await started.wait()
+        task = flight._in_flight[("key",)]
+
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert not task.cancelled()
+        release.set()
+        assert await second == "result"
+
+        release.clear()
+        third = asyncio.create_task(flight.do(("other",), factory))
+        await asyncio.sleep(0)
+        task = flight._in_flight[("other",)]
+        third.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await third
+        await asyncio.sleep(0)
+        assert task.cancelled() and ("other",) not in flight._in_flight
+
+    asyncio.run(main())
@@ -3,11 +3,16 @@ import sys
 
 from loguru import logger
 
-from .functions import call_with_retry
 from .functions import clip_tokens
 from .functions import convert_to_markdown
+from .functions import dump_yaml
+from .functions import get_file_language
 from .functions import is_valid_file
 from .functions import load_yaml
+from .functions import load_yaml_completed
+from .functions import merge_yaml_data
+from .retry import call_with_retry
+from .retry import is_retryable
 from config import CONFIG
 
 if log_dir := CONFIG.log.dir:
@@ -43,6 +48,11 @@ __all__ = [
     "call_with_retry",
     "clip_tokens",
     "convert_to_markdown",
+    "dump_yaml",
+    "get_file_language",
+    "is_retryable",
     "is_valid_file",
     "load_yaml",
+    "load_yaml_completed",
+    "merge_yaml_data",
 ]
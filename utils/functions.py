@@ -1,12 +1,16 @@
-from functools import wraps
+import re
 
 import yaml
 
 from defines import BAD_EXTENSIONS
 from defines import CONSTANTS
+from defines import EXTENSION_LANGUAGE_MAP
 from utils import logger
 
 
+_YAML_KEY_PATTERN = re.compile(r"^([^\s#\-][^:]*):(.*)$")
+
+
 def _parse_code_suggestion(data):
     """
     将dict转换为markdown格式（专门处理代码建议的）。
@@ -135,9 +139,87 @@ def load_yaml(response_text):
     return data
 
 
+def load_yaml_completed(response_text):
+    """
+    解析流式响应中已经完整输出的YAML片段（以最后一个不超过二级的key作为分界，分界之后的内容可能尚未输出完整）
+
+    Args:
+        response_text (str): 截止目前收到的响应内容
+
+    Returns:
+        tuple[dict | None, int]: 已完整部分解析出的数据(解析失败时为None)，以及已完整部分的字符数
+    """
+    lines = response_text.removeprefix("```yaml").lstrip("\n").split("\n")
+    boundaries = []
+    scalar_indent = None  # 处于块标量(|-、>-)内容中时记录其key的缩进
+    for i, line in enumerate(lines):
+        if not line.strip():
+            continue
+        indent = len(line) - len(line.lstrip(" "))
+        if scalar_indent is not None:
+            if indent > scalar_indent:
+                continue
+            scalar_indent = None
+        stripped = line.lstrip(" ")
+        if stripped.startswith("- "):
+            stripped = stripped[2:]
+            indent += 2
+        if match := _YAML_KEY_PATTERN.match(stripped):
+            if indent <= 2:
+                boundaries.append(i)
+            if match.group(2).strip().startswith(("|", ">")):
+                scalar_indent = indent
+    if len(boundaries) < 2:
+        return None, 0
+    completed = "\n".join(lines[: boundaries[-1]])
+    try:
+        data = yaml.safe_load(completed)
+    except Exception:
+        data = None
+    return (data if isinstance(data, dict) else None), len(completed)
+
+
+def merge_yaml_data(datas):
+    """
+    合并多份结构相同的YAML数据：字典按key递归合并，列表拼接并去重，其他值保留第一个非空的
+
+    Args:
+        datas (list): 待合并的数据
+
+    Returns:
+        Any: 合并后的数据
+    """
+    values = [data for data in datas if data not in (None, "", [], {})]
+    if not values:
+        return datas[0] if datas else None
+    if all(isinstance(value, dict) for value in values):
+        keys = list(dict.fromkeys(key for value in values for key in value))
+        return {key: merge_yaml_data([value[key] for value in values if key in value]) for key in keys}
+    if all(isinstance(value, list) for value in values):
+        merged = []
+        for item in (item for value in values for item in value):
+            if item not in merged:
+                merged.append(item)
+        return merged
+    return values[0]
+
+
+def dump_yaml(data):
+    """
+    将数据转换为YAML格式字符串
+
+    Args:
+        data (dict):
+
+    Returns:
+        str
+    """
+    return yaml.safe_dump(data, allow_unicode=True, sort_keys=False)
+
+
 def clip_tokens(token_handler, text, max_tokens):
     """
-    将字符串中的令牌数量裁剪为最大令牌数量(如果超出限制的话)。
+    将字符串中的令牌数量裁剪为最大令牌数量(如果超出限制的话)，在编码后的token序列上精确截断。
 
     Args:
         token_handler (TokenHandler):
@@ -151,43 +233,44 @@ def clip_tokens(token_handler, text, max_tokens):
         return text
 
     try:
-        if (num_input_tokens := token_handler.count_tokens(text)) <= max_tokens:
+        # 每个token至少对应一个字节，字节数不超过上限时无需编码
+        if len(text.encode("utf-8", errors="surrogatepass")) <= max_tokens:
+            return text
+        tokens = token_handler.encoder.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
             return text
-        chars_per_token = len(text) / num_input_tokens
-        num_output_chars = int(chars_per_token * max_tokens)
-        return text[:num_output_chars]
+        # 截断处可能落在多字节字符的中间，丢弃不完整的字节
+        return token_handler.encoder.decode(tokens[:max_tokens], errors="ignore")
     except Exception as e:
         logger.warning(f"Failed to clip tokens: {e}")
         return text
 
 
-def call_with_retry(function):
+def is_valid_file(filename):
     """
-    装饰器: 异常捕获。
+    过滤掉不支持的文件
+
+    Args:
+        filename (str): 文件名
 
     Returns:
-        str | None:
+        bool: 是否有序
     """
-
-    @wraps(function)
-    def wrapper(*args, **kwargs):
-        for _ in range(3):
-            try:
-                return function(*args, **kwargs)
-            except Exception as ex:
-                logger.debug(ex)
-
-    return wrapper
+    return filename.split(".")[-1] not in BAD_EXTENSIONS
 
 
-def is_valid_file(filename):
+def get_file_language(filename):
     """
-    过滤掉不支持的文件
+    根据扩展名（没有扩展名时根据文件名，例如Makefile）获取文件的语言
 
     Args:
         filename (str): 文件名
 
     Returns:
-        bool: 是否有序
+        str | None: 语言名称，无法识别时为None
     """
-    return filename.split(".")[-1] not in BAD_EXTENSIONS
+    basename = filename.rsplit("/", 1)[-1]
+    _, dot, extension = basename.rpartition(".")
+    key = f".{extension}" if dot else basename
+    # 大小写不同的扩展名可能属于不同的语言（例如.c和.C），优先精确匹配
+    return EXTENSION_LANGUAGE_MAP.get(key) or EXTENSION_LANGUAGE_MAP.get(key.lower())
@@ -0,0 +1,183 @@
+import asyncio
+import inspect
+import random
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+import gitlab
+import httpx
+import requests
+
+from config import CONFIG
+from utils import logger
+
+# 可以重试的HTTP状态码（超时、限流以及服务端错误）
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+
+class RetryBudget:
+    """
+    进程级的重试预算：统计窗口内的重试次数不超过调用次数的固定比例(至少允许min_retries次)，
+    避免下游故障时大量重试进一步放大负载
+    """
+
+    def __init__(self, ratio, min_retries, window):
+        """
+
+        Args:
+            ratio (float): 重试次数相对于调用次数的比例上限
+            min_retries (int): 统计窗口内至少允许的重试次数
+            window (float): 统计窗口(秒)
+        """
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self._calls = deque()
+        self._retries = deque()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        for events in (self._calls, self._retries):
+            while events and events[0] <= now - self.window:
+                events.popleft()
+
+    def record_call(self):
+        """
+        记录一次调用（重试不计入）
+
+        Returns:
+            None
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            self._calls.append(now)
+
+    def try_spend(self):
+        """
+        尝试消耗一次重试
+
+        Returns:
+            bool: 预算耗尽时返回False
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if len(self._retries) >= max(self.min_retries, self.ratio * len(self._calls)):
+                return False
+            self._retries.append(now)
+            return True
+
+
+RETRY_BUDGET = RetryBudget(CONFIG.retry.budget_ratio, CONFIG.retry.budget_min_retries, CONFIG.retry.budget_window)
+
+
+def _get_response(ex):
+    if isinstance(ex, (httpx.HTTPStatusError, requests.HTTPError)):
+        return ex.response
+    return None
+
+
+def is_retryable(ex):
+    """
+    判断异常是否属于可以重试的临时故障：超时、连接错误以及429/5xx等响应
+
+    Args:
+        ex (Exception):
+
+    Returns:
+        bool
+    """
+    if isinstance(ex, TimeoutError):
+        return True
+    if (response := _get_response(ex)) is not None:
+        return response.status_code in RETRYABLE_STATUS
+    if isinstance(ex, (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)):
+        return True
+    if isinstance(ex, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(ex, gitlab.exceptions.GitlabError):
+        return ex.response_code in RETRYABLE_STATUS
+    return False
+
+
+def _retry_delay(ex, attempt, attempts, retryable):
+    """
+    计算下一次重试前等待的时间：带有完全抖动的指数退避，响应中有Retry-After时至少等待该时间
+
+    Args:
+        ex (Exception): 本次调用的异常
+        attempt (int): 已经调用的次数
+        attempts (int): 最多调用的次数
+        retryable (Callable[[Exception], bool]): 判断异常是否可以重试
+
+    Returns:
+        float | None: 不能重试时为None
+    """
+    if attempt >= attempts or not retryable(ex) or not RETRY_BUDGET.try_spend():
+        return None
+    delay = random.uniform(0, min(CONFIG.retry.max_delay, CONFIG.retry.base_delay * 2 ** (attempt - 1)))
+    if (response := _get_response(ex)) is not None:
+        try:
+            delay = max(delay, float(response.headers.get("Retry-After", 0)))
+        except ValueError:
+            pass
+    return min(delay, CONFIG.retry.max_delay)
+
+
+def call_with_retry(function=None, *, attempts=None, retryable=is_retryable):
+    """
+    装饰器: 临时故障时按指数退避重试（同时支持同步函数和协程函数），不可重试的异常或者重试耗尽后原样抛出
+
+    Args:
+        function (Callable): 被装饰的函数
+        attempts (int | None): 最多调用的次数，默认使用retry.attempts
+        retryable (Callable[[Exception], bool]): 判断异常是否可以重试
+
+    Returns:
+        Callable
+    """
+    if function is None:
+        return lambda f: call_with_retry(f, attempts=attempts, retryable=retryable)
+
+    def _attempts():
+        return attempts or CONFIG.retry.attempts
+
+    def _log(ex, attempt, delay):
+        logger.warning(f"{function.__qualname__} failed: {ex!r}, retry {attempt} after {delay:.1f}s")
+
+    if inspect.iscoroutinefunction(function):
+
+        @wraps(function)
+        async def async_wrapper(*args, **kwargs):
+            RETRY_BUDGET.record_call()
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    return await function(*args, **kwargs)
+                except Exception as ex:
+                    if (delay := _retry_delay(ex, attempt, _attempts(), retryable)) is None:
+                        raise
+                    _log(ex, attempt, delay)
+                    await asyncio.sleep(delay)
+
+        return async_wrapper
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        RETRY_BUDGET.record_call()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return function(*args, **kwargs)
+            except Exception as ex:
+                if (delay := _retry_delay(ex, attempt, _attempts(), retryable)) is None:
+                    raise
+                _log(ex, attempt, delay)
+                time.sleep(delay)
+
+    return wrapper